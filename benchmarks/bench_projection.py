@@ -0,0 +1,73 @@
+# benchmarks/bench_projection.py
+# Compare le décodage complet (json.loads) et le décodage par projection de PushEvent
+# sur des payloads push de 1000 et 2000 commits : temps de décodage et pic mémoire.
+#
+#   python benchmarks/bench_projection.py
+import os
+import sys
+import json
+import time
+import resource
+import tracemalloc
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.payloads import make_push_payload
+
+SIZES = (1000, 2000)
+REPEAT = 5
+
+
+def _decode(mode: str, raw: bytes):
+    if mode == "json.loads":
+        return json.loads(raw)
+    from event import PushEvent
+    return PushEvent.decode(raw)
+
+
+def _run(mode: str, commit_count: int, queue):
+    raw = json.dumps(make_push_payload(commit_count)).encode("utf-8")
+    # Décodage d'un petit payload avant les mesures : l'import de event ne compte pas dans le pic mémoire
+    _decode(mode, json.dumps(make_push_payload(1)).encode("utf-8"))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    tracemalloc.start()
+    data = _decode(mode, raw)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del data
+
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        data = _decode(mode, raw)
+        timings.append(time.perf_counter() - start)
+        del data
+
+    queue.put({
+        "payload_kb": len(raw) / 1024,
+        "decode_ms": min(timings) * 1000,
+        "traced_peak_kb": traced_peak / 1024,
+        "rss_delta_kb": rss_after - rss_before,
+    })
+
+
+def main():
+    # Un process par mesure pour que le pic RSS de l'une ne masque pas l'autre
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'commits':>8} {'mode':>11} {'payload':>10} {'decode':>10} {'peak py':>11} {'peak RSS':>11}")
+    for commit_count in SIZES:
+        for mode in ("json.loads", "projection"):
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run, args=(mode, commit_count, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            print(f"{commit_count:>8} {mode:>11} {result['payload_kb']:>8.0f}Ko {result['decode_ms']:>8.1f}ms "
+                  f"{result['traced_peak_kb']:>9.0f}Ko {result['rss_delta_kb']:>9.0f}Ko")
+
+
+if __name__ == "__main__":
+    main()
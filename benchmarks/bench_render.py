@@ -0,0 +1,134 @@
+# benchmarks/bench_render.py
+# Compare les anciennes fonctions format_* (f-strings + escape_markdown) aux templates compilés
+# de messages.py : temps et mémoire allouée par message, échappement compris.
+#
+#   python benchmarks/bench_render.py
+#   MESSAGE_PARSE_MODE=MarkdownV2 python benchmarks/bench_render.py
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import messages
+from render import MESSAGE_PARSE_MODE
+
+ITERATIONS = 20000
+# Meilleur temps sur N séries : les autres process de la machine ne comptent pas dans la mesure
+REPEATS = 5
+
+REPO_NAME = "org/api_gateway"
+REPO_URL = "https://github.com/org/api_gateway"
+COMMIT_MESSAGE = "Fix [cache] invalidation for *all* user_sessions\n\n" + "Détails du changement. " * 20
+PR_TITLE = "Add retry_after handling to the [sender] worker pool"
+REVIEW_BODY = "Looks good, but see the comment about `_acquire` and the *jitter* value."
+
+
+# Anciennes fonctions de messages.py, gardées ici comme référence
+def escape_markdown(text: str) -> str:
+    return text.replace('*', '').replace('_', '').replace('[', '').replace(']', '')
+
+
+def legacy_push(repo_name, ref, commit_count, commit_message, sender_username, repo_url):
+    repo_name, ref, commit_message = escape_markdown(repo_name), escape_markdown(ref), escape_markdown(commit_message)
+    return (
+        f"{messages.EMOJI_PUSH} **Nouveau Push sur** `{repo_name}`\n"
+        f"{messages.EMOJI_BRANCH} **Branche/Tag :** `{ref}`\n"
+        f"{messages.EMOJI_COMMIT} **Commits :** {commit_count}\n"
+        f"{messages.EMOJI_TOOLS} **Dernier commit :** {commit_message[:200]}...\n"
+        f"{messages.EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
+        f"{messages.EMOJI_LINK} [Voir dépôt]({repo_url})"
+    )
+
+
+def legacy_pull_request(repo_name, pr_number, pr_title, head_branch, base_branch, sender_username, pr_reviewers_str, pr_url, repo_url=""):
+    repo_name, pr_title = escape_markdown(repo_name), escape_markdown(pr_title)
+    head_branch, base_branch = escape_markdown(head_branch), escape_markdown(base_branch)
+    return (
+        f"{messages.EMOJI_PR} **Nouvelle Pull Request sur** `{repo_name}`\n"
+        f"{messages.EMOJI_PR_NUMBER} **PR #{pr_number} :** {pr_title[:100]}...\n"
+        f"{messages.EMOJI_BRANCH} **Branche :** `{head_branch}` → `{base_branch}`\n"
+        f"{messages.EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
+        f"{messages.EMOJI_REVIEWERS} **Reviewers assignés :** {pr_reviewers_str}\n"
+        f"{messages.EMOJI_LINK} [Voir PR]({pr_url})"
+    )
+
+
+def legacy_pull_request_review(emoji, reviewer, state_str, pr_author, pr_number, pr_title, body, pr_url):
+    pr_title, body = escape_markdown(pr_title), escape_markdown(body)
+    msg = (
+        f"{emoji} {reviewer} {state_str} la PR de {pr_author} :\n"
+        f"{messages.EMOJI_PR_NUMBER} **PR #{pr_number} :** {pr_title[:100]}...\n"
+    )
+    if body:
+        msg += f"**Commentaire :**\n{body[:200]}...\n"
+    msg += f"{messages.EMOJI_LINK} [Voir PR]({pr_url})"
+    return msg
+
+
+def legacy_create(action, repo_name, ref, sender_username, repo_url):
+    repo_name, ref = escape_markdown(repo_name), escape_markdown(ref)
+    return (
+        f"{messages.EMOJI_CREATE} **{action} :** `{repo_name}`\n"
+        f"{messages.EMOJI_BRANCH} **Nom :** `{ref}`\n"
+        f"{messages.EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
+        f"{messages.EMOJI_LINK} [Voir dépôt]({repo_url})"
+    )
+
+
+CASES = {
+    "push": (legacy_push, messages.format_push_message, dict(
+        repo_name=REPO_NAME, ref="feature/user_sessions", commit_count=12, commit_message=COMMIT_MESSAGE,
+        sender_username="@dev_one", repo_url=REPO_URL)),
+    "pull_request": (legacy_pull_request, messages.format_pull_request_message, dict(
+        repo_name=REPO_NAME, pr_number=42, pr_title=PR_TITLE, head_branch="feature/retry_after", base_branch="main",
+        sender_username="@dev_one", pr_reviewers_str="@dev_two, @dev_three", pr_url=REPO_URL + "/pull/42",
+        repo_url=REPO_URL)),
+    "pull_request_review": (legacy_pull_request_review, messages.format_pull_request_review_message, dict(
+        emoji="✅", reviewer="@dev_two", state_str="a approuvé", pr_author="@dev_one", pr_number=42,
+        pr_title=PR_TITLE, body=REVIEW_BODY, pr_url=REPO_URL + "/pull/42")),
+    "create": (legacy_create, messages.format_create_event_message, dict(
+        action="Nouvel branche Créé", repo_name=REPO_NAME, ref="feature/user_sessions",
+        sender_username="@dev_one", repo_url=REPO_URL)),
+}
+
+
+def time_per_message(function, kwargs) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            function(**kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best / ITERATIONS
+
+
+# Pic de mémoire allouée pendant un appel, en octets (moyenne sur 1000 appels)
+def bytes_per_message(function, kwargs) -> float:
+    total = 0
+    tracemalloc.start()
+    for _ in range(1000):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        function(**kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - baseline
+    tracemalloc.stop()
+    return total / 1000
+
+
+def main():
+    print(f"Parse mode : {MESSAGE_PARSE_MODE}, meilleure de {REPEATS} séries de {ITERATIONS} itérations")
+    print(f"{'message':<22}{'ancien (µs)':>13}{'compilé (µs)':>14}{'ancien (o)':>12}{'compilé (o)':>13}")
+    for name, (legacy, compiled, kwargs) in CASES.items():
+        legacy(**kwargs), compiled(**kwargs)
+        print(f"{name:<22}"
+              f"{time_per_message(legacy, kwargs) * 1e6:>13.2f}"
+              f"{time_per_message(compiled, kwargs) * 1e6:>14.2f}"
+              f"{bytes_per_message(legacy, kwargs):>12.0f}"
+              f"{bytes_per_message(compiled, kwargs):>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
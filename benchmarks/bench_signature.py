@@ -0,0 +1,86 @@
+# benchmarks/bench_signature.py
+# Coût de la vérification de signature des webhooks GitHub par taille de payload : HMAC créé pour
+# chaque requête (secret réencodé + hmac.new) contre HMAC pré-initialisé copié (signatures.py),
+# body haché par morceaux de 64 Ko comme dans read_signed_body, et surcoût d'un second secret
+# essayé pendant une rotation.
+#
+#   python benchmarks/bench_signature.py
+import os
+import sys
+import hmac
+import time
+import hashlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from signatures import SecretSet, SigningKey
+
+SECRET = "bench-secret-0123456789"
+OLD_SECRET = "bench-old-secret-9876543210"
+CHUNK_SIZE = 64 * 1024
+SIZES = [1024, 16 * 1024, 256 * 1024, 1024 * 1024, 5 * 1024 * 1024, 25 * 1024 * 1024]
+# Octets hachés par cas, pour que les petits payloads soient mesurés sur assez d'itérations
+BYTES_PER_CASE = 256 * 1024 * 1024
+
+
+def chunks(body: bytes):
+    return [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+
+
+def signature(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+# Ancienne vérification : secret réencodé et HMAC initialisé à chaque requête
+def verify_fresh(parts, body: bytes, sig: str) -> bool:
+    mac = hmac.new(SECRET.encode("utf-8"), digestmod=hashlib.sha256)
+    for part in parts:
+        mac.update(part)
+    return hmac.compare_digest("sha256=" + mac.hexdigest(), sig)
+
+
+def verify_keyed(secrets: SecretSet, parts, body: bytes, sig: str) -> bool:
+    index = secrets.preferred
+    mac = secrets.mac(index)
+    for part in parts:
+        mac.update(part)
+    return secrets.verify(sig, body, mac.hexdigest(), index)
+
+
+def time_per_request(function, size: int) -> float:
+    iterations = max(3, BYTES_PER_CASE // size)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        assert function()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    print(f"Morceaux de {CHUNK_SIZE // 1024} Ko, ~{BYTES_PER_CASE // (1024 * 1024)} Mo hachés par cas")
+    print(f"{'taille':>10}{'nouveau (µs)':>14}{'copié (µs)':>12}{'rotation (µs)':>15}{'copié (ms/Mo)':>15}{'copié (Mo/s)':>14}")
+    for size in SIZES:
+        body = os.urandom(size)
+        parts = chunks(body)
+        sig = signature(SECRET, body)
+        current = SecretSet([SigningKey(SECRET)])
+        # Rotation : GitHub signe déjà avec le nouveau secret mais l'ancien est encore le préféré
+        rotation = SecretSet([SigningKey(OLD_SECRET), SigningKey(SECRET)])
+
+        def rotating():
+            rotation.preferred = 0
+            return verify_keyed(rotation, parts, body, sig)
+
+        fresh = time_per_request(lambda: verify_fresh(parts, body, sig), size)
+        keyed = time_per_request(lambda: verify_keyed(current, parts, body, sig), size)
+        fallback = time_per_request(rotating, size)
+        megabytes = size / (1024 * 1024)
+        print(f"{size // 1024:>8}Ko"
+              f"{fresh * 1e6:>14.1f}"
+              f"{keyed * 1e6:>12.1f}"
+              f"{fallback * 1e6:>15.1f}"
+              f"{keyed * 1e3 / megabytes:>15.3f}"
+              f"{megabytes / keyed:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/fake_telegram.py
+# Faux serveur de l'API Bot Telegram pour les tests de charge, avec latence et 429 injectés.
+# Le bot s'y connecte avec TELEGRAM_API_URL=http://127.0.0.1:8081
+#
+#   python benchmarks/fake_telegram.py --port 8081 --latency 0.05 --rate-429 0.02
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import parse_qsl
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+# Marqueur placé par loadgen.py dans le nom du dépôt pour mesurer la latence de bout en bout
+MARKER = re.compile(r"bench-(\d+)")
+
+app = FastAPI()
+app.state.latency = 0.0
+app.state.jitter = 0.0
+app.state.rate_429 = 0.0
+app.state.retry_after = 1
+app.state.received = {}
+app.state.counts = {}
+app.state.message_id = 0
+app.state.webhook_url = ""
+app.state.allowed_updates = []
+
+
+async def _params(request: Request) -> dict:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return await request.json()
+    # python-telegram-bot envoie les paramètres en application/x-www-form-urlencoded
+    return dict(parse_qsl((await request.body()).decode("utf-8")))
+
+
+def _ok(result) -> dict:
+    return {"ok": True, "result": result}
+
+
+@app.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    params = await _params(request)
+    app.state.counts[method] = app.state.counts.get(method, 0) + 1
+    latency = app.state.latency + random.uniform(0, app.state.jitter)
+    if latency:
+        await asyncio.sleep(latency)
+
+    if method == "getMe":
+        return _ok({"id": int(token.split(":")[0]) if token.split(":")[0].isdigit() else 1, "is_bot": True,
+                    "first_name": "FakeBot", "username": "fake_bot", "can_join_groups": True,
+                    "can_read_all_group_messages": False, "supports_inline_queries": False})
+    if method in ("setWebhook", "deleteWebhook"):
+        app.state.webhook_url = params.get("url", "")
+        allowed_updates = params.get("allowed_updates", [])
+        app.state.allowed_updates = json.loads(allowed_updates) if isinstance(allowed_updates, str) else allowed_updates
+        return _ok(True)
+    if method == "getWebhookInfo":
+        return _ok({"url": app.state.webhook_url, "has_custom_certificate": False, "pending_update_count": 0,
+                    "allowed_updates": app.state.allowed_updates})
+
+    if method in ("sendMessage", "editMessageText"):
+        if random.random() < app.state.rate_429:
+            app.state.counts["429"] = app.state.counts.get("429", 0) + 1
+            return JSONResponse(status_code=429, content={
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {app.state.retry_after}",
+                "parameters": {"retry_after": app.state.retry_after}})
+
+        marker = MARKER.search(params.get("text", ""))
+        if marker:
+            app.state.received[int(marker.group(1))] = time.time()
+        app.state.message_id += 1
+        chat_id = params.get("chat_id", 0)
+        return _ok({"message_id": app.state.message_id, "date": int(time.time()),
+                    "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 0, "type": "supergroup"},
+                    "text": params.get("text", "")})
+
+    return _ok(True)
+
+
+# Heures de réception par marqueur, lues par loadgen.py
+@app.get("/_bench/received")
+async def received():
+    return {"received": app.state.received, "counts": app.state.counts}
+
+
+@app.post("/_bench/reset")
+async def reset():
+    app.state.received = {}
+    app.state.counts = {}
+    return {"ok": True}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faux serveur de l'API Bot Telegram")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="Latence fixe par appel (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Latence aléatoire ajoutée (s)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Proportion de sendMessage répondant 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after renvoyé avec les 429 (s)")
+    args = parser.parse_args()
+    app.state.latency = args.latency
+    app.state.jitter = args.jitter
+    app.state.rate_429 = args.rate_429
+    app.state.retry_after = args.retry_after
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,151 @@
+# benchmarks/loadgen.py
+# Générateur de charge pour /webhook : envoie des livraisons GitHub signées avec une concurrence donnée
+# et mesure le débit, la latence d'acquittement et la latence de bout en bout (jusqu'à la réception
+# du sendMessage par benchmarks/fake_telegram.py), ainsi que la mémoire du process du bot.
+#
+#   python benchmarks/fake_telegram.py --latency 0.05 --rate-429 0.01 &
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 TELEGRAM_CHAT_RATE_PER_MINUTE=100000 TELEGRAM_GLOBAL_RATE=100000 \
+#       python main.py &
+#   python benchmarks/loadgen.py --requests 1000 --concurrency 50 --bot-pid $!
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from typing import Dict, List, Optional, Tuple
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.payloads import CORPUS, github_event, make_payload, sign
+
+DEFAULT_MIX = "push_small=55,push_1k=3,push_5k=1,pull_request=15,pull_request_review=15," \
+              "create_branch_event=6,delete_branch_event=5"
+# Nom de dépôt de même longueur pour chaque requête : le marqueur se retrouve dans le message Telegram
+PLACEHOLDER = "bench/bench-0000000000"
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        if name not in CORPUS:
+            raise SystemExit(f"Type inconnu dans --mix : {name} (possibles : {', '.join(CORPUS)})")
+        weights[name] = int(weight)
+    return weights
+
+
+def build_requests(count: int, weights: Dict[str, int], secret: str) -> List[Tuple[int, str, bytes, Dict]]:
+    templates = {name: json.dumps(make_payload(name, PLACEHOLDER)).encode("utf-8") for name in weights}
+    names = random.choices(list(weights), weights=list(weights.values()), k=count)
+    requests = []
+    for i, name in enumerate(names):
+        body = templates[name].replace(PLACEHOLDER.encode(), f"bench/bench-{i:010d}".encode())
+        headers = {
+            "Content-Type": "application/json",
+            "X-GitHub-Event": github_event(name),
+            "X-GitHub-Delivery": f"bench-{os.getpid()}-{i}",
+            "X-Hub-Signature-256": sign(body, secret),
+        }
+        requests.append((i, name, body, headers))
+    return requests
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    def pick(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] * 1000
+    return f"p50={pick(50):.1f}ms p95={pick(95):.1f}ms p99={pick(99):.1f}ms max={values[-1] * 1000:.1f}ms"
+
+
+def read_rss(pid: Optional[int]) -> str:
+    if not pid:
+        return "n/a (--bot-pid non fourni)"
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            fields[key] = value.strip()
+    return f"RSS={fields.get('VmRSS', '?')} pic={fields.get('VmHWM', '?')}"
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    requests = build_requests(args.requests, weights, args.secret)
+    print(f"{len(requests)} requêtes préparées, concurrence {args.concurrency}")
+
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        if args.fake_telegram:
+            await client.post(f"{args.fake_telegram}/_bench/reset")
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        sent_at: Dict[int, float] = {}
+        ack_latencies: List[float] = []
+        statuses: Dict[int, int] = {}
+
+        async def deliver(i, name, body, headers):
+            async with semaphore:
+                start = time.time()
+                try:
+                    response = await client.post(args.url, content=body, headers=headers)
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                ack_latencies.append(time.time() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 202:
+                    sent_at[i] = start
+
+        started = time.time()
+        await asyncio.gather(*(deliver(*request) for request in requests))
+        elapsed = time.time() - started
+
+        e2e_latencies = []
+        counts = {}
+        if args.fake_telegram:
+            # On attend que tous les messages acceptés soient arrivés au faux serveur Telegram
+            deadline = time.time() + args.drain_timeout
+            while True:
+                state = (await client.get(f"{args.fake_telegram}/_bench/received")).json()
+                received = {int(k): v for k, v in state["received"].items()}
+                counts = state["counts"]
+                if all(i in received for i in sent_at) or time.time() > deadline:
+                    break
+                await asyncio.sleep(0.2)
+            e2e_latencies = [received[i] - sent_at[i] for i in sent_at if i in received]
+
+    print(f"Statuts HTTP : {dict(sorted(statuses.items()))}")
+    print(f"Débit : {len(requests) / elapsed:.1f} req/s ({elapsed:.2f}s)")
+    print(f"Acquittement : {percentiles(ack_latencies)}")
+    if args.fake_telegram:
+        print(f"Bout en bout : {percentiles(e2e_latencies)} ({len(e2e_latencies)}/{len(sent_at)} reçus)")
+        print(f"Appels Telegram : {counts}")
+    print(f"Mémoire du bot : {read_rss(args.bot_pid)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du webhook GitHub")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=os.getenv("GITHUB_SECRET", ""))
+    parser.add_argument("--fake-telegram", default="http://127.0.0.1:8081",
+                        help="URL du faux serveur Telegram, vide pour ne mesurer que l'acquittement")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Poids de chaque type du corpus, ex. push_small=9,push_5k=1")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--bot-pid", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not args.secret:
+        raise SystemExit("GITHUB_SECRET ou --secret requis")
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
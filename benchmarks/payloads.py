@@ -0,0 +1,154 @@
+# benchmarks/payloads.py
+# Corpus de payloads GitHub réalistes pour chaque type de EVENT_CLASSES, signés comme par GitHub.
+#
+#   python benchmarks/payloads.py --out benchmarks/corpus
+import os
+import json
+import hmac
+import uuid
+import hashlib
+import argparse
+from typing import Dict, List, Tuple
+
+# Taille des push du corpus, dont des push énormes (force-push de monorepo)
+PUSH_SIZES = {"push_small": 3, "push_1k": 1000, "push_5k": 5000}
+
+
+def _user(i: int) -> Dict:
+    return {"login": f"dev{i}", "id": 1000 + i, "node_id": f"MDQ6VXNlcj{i}", "type": "User",
+            "avatar_url": f"https://avatars.githubusercontent.com/u/{1000 + i}?v=4",
+            "html_url": f"https://github.com/dev{i}", "url": f"https://api.github.com/users/dev{i}",
+            "site_admin": False}
+
+
+def _repository(full_name: str) -> Dict:
+    owner, name = full_name.split("/", 1)
+    api = f"https://api.github.com/repos/{full_name}"
+    return {"id": 4242, "node_id": "R_kgDOAAAA", "name": name, "full_name": full_name, "private": False,
+            "owner": {**_user(0), "login": owner}, "html_url": f"https://github.com/{full_name}",
+            "description": "Dépôt utilisé pour les benchmarks du bot", "fork": False, "url": api,
+            **{f"{k}_url": f"{api}/{k}" for k in ("issues", "pulls", "commits", "branches", "tags", "events",
+                                                 "hooks", "labels", "releases", "deployments")},
+            "default_branch": "main", "stargazers_count": 12, "watchers_count": 12, "forks_count": 3}
+
+
+def make_push_payload(commit_count: int, full_name: str = "org/repo") -> Dict:
+    commits = [
+        {
+            "id": f"{i:040x}",
+            "tree_id": f"{i * 7:040x}",
+            "distinct": True,
+            "message": f"Commit {i}\n\n" + "Description du changement. " * 10,
+            "timestamp": "2025-06-05T12:00:00+02:00",
+            "url": f"https://github.com/{full_name}/commit/{i:040x}",
+            "author": {"name": f"Dev {i % 20}", "email": f"dev{i % 20}@example.com", "username": f"dev{i % 20}"},
+            "committer": {"name": f"Dev {i % 20}", "email": f"dev{i % 20}@example.com", "username": f"dev{i % 20}"},
+            "added": [f"src/module_{i}/new_{j}.py" for j in range(3)],
+            "removed": [],
+            "modified": [f"src/module_{i}/file_{j}.py" for j in range(8)],
+        }
+        for i in range(commit_count)
+    ]
+    return {
+        "ref": "refs/heads/main",
+        "before": "1" * 40,
+        "after": f"{commit_count:040x}",
+        "created": False,
+        "deleted": False,
+        "forced": commit_count > 100,
+        "compare": f"https://github.com/{full_name}/compare/a...b",
+        "commits": commits,
+        "head_commit": commits[-1] if commits else None,
+        "repository": _repository(full_name),
+        "pusher": {"name": "dev0", "email": "dev0@example.com"},
+        "sender": _user(0),
+    }
+
+
+def _pull_request(full_name: str) -> Dict:
+    return {"number": 42, "state": "open", "draft": False, "title": "Ajoute le regroupement des push",
+            "body": "Description détaillée de la PR.\n" * 20, "html_url": f"https://github.com/{full_name}/pull/42",
+            "user": _user(1), "requested_reviewers": [_user(i) for i in range(2, 6)],
+            "head": {"ref": "feature/coalesce", "sha": "a" * 40, "repo": _repository(full_name)},
+            "base": {"ref": "main", "sha": "b" * 40, "repo": _repository(full_name)},
+            "additions": 120, "deletions": 30, "changed_files": 6}
+
+
+def make_payload(event_type: str, full_name: str = "org/repo") -> Dict:
+    if event_type in PUSH_SIZES:
+        return make_push_payload(PUSH_SIZES[event_type], full_name)
+    if event_type == "pull_request":
+        return {"action": "opened", "number": 42, "pull_request": _pull_request(full_name),
+                "repository": _repository(full_name), "sender": _user(1)}
+    if event_type == "pull_request_review":
+        return {"action": "submitted", "pull_request": _pull_request(full_name),
+                "review": {"id": 7, "user": _user(2), "state": "changes_requested", "body": "Quelques remarques.",
+                           "html_url": f"https://github.com/{full_name}/pull/42#pullrequestreview-7"},
+                "repository": _repository(full_name), "sender": _user(2)}
+    if event_type in ("create_branch_event", "delete_branch_event"):
+        return {"ref": "feature/coalesce", "ref_type": "branch", "master_branch": "main", "pusher_type": "user",
+                "repository": _repository(full_name), "sender": _user(1)}
+    if event_type == "workflow_run":
+        return {"action": "completed",
+                "workflow_run": {"id": 9001, "name": "CI", "head_branch": "main", "head_sha": "c" * 40,
+                                 "run_number": 314, "run_attempt": 1, "event": "push", "status": "completed",
+                                 "conclusion": "success", "workflow_id": 77,
+                                 "html_url": f"https://github.com/{full_name}/actions/runs/9001",
+                                 "head_commit": {"id": "c" * 40, "message": "Commit 0"},
+                                 "actor": _user(0), "triggering_actor": _user(0), "repository": _repository(full_name)},
+                "repository": _repository(full_name), "sender": _user(0)}
+    if event_type == "check_run":
+        return {"action": "completed",
+                "check_run": {"id": 5005, "name": "tests (3.11)", "head_sha": "c" * 40, "status": "completed",
+                              "conclusion": "failure", "html_url": f"https://github.com/{full_name}/runs/5005",
+                              "output": {"title": "2 tests en échec", "summary": "Détails des échecs.\n" * 50},
+                              "check_suite": {"id": 6006, "head_branch": "main", "head_sha": "c" * 40},
+                              "app": {"id": 15368, "name": "GitHub Actions"}},
+                "repository": _repository(full_name), "sender": _user(0)}
+    if event_type == "check_suite":
+        return {"action": "completed",
+                "check_suite": {"id": 6006, "head_branch": "main", "head_sha": "c" * 40, "status": "completed",
+                                "conclusion": "success", "before": "b" * 40, "after": "c" * 40,
+                                "app": {"id": 15368, "name": "GitHub Actions"}, "latest_check_runs_count": 4},
+                "repository": _repository(full_name), "sender": _user(0)}
+    raise ValueError(f"Type d'évènement inconnu : {event_type}")
+
+
+# Nom de l'évènement GitHub (header X-GitHub-Event) pour chaque entrée du corpus
+def github_event(name: str) -> str:
+    return "push" if name in PUSH_SIZES else name
+
+
+CORPUS = list(PUSH_SIZES) + ["pull_request", "pull_request_review", "create_branch_event", "delete_branch_event",
+                             "workflow_run", "check_run", "check_suite"]
+
+
+def sign(body: bytes, secret: str) -> str:
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+# Body et headers d'une livraison, avec un identifiant de livraison unique
+def signed_delivery(name: str, secret: str, full_name: str = "org/repo") -> Tuple[bytes, Dict[str, str]]:
+    body = json.dumps(make_payload(name, full_name)).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": github_event(name),
+        "X-GitHub-Delivery": str(uuid.uuid4()),
+        "X-Hub-Signature-256": sign(body, secret),
+    }
+    return body, headers
+
+
+def write_corpus(directory: str, names: List[str] = CORPUS):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        path = os.path.join(directory, f"{name}.json")
+        with open(path, "w") as f:
+            json.dump(make_payload(name), f)
+        print(f"{path} : {os.path.getsize(path) / 1024:.0f} Ko")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Génère le corpus de payloads GitHub")
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus"))
+    write_corpus(parser.parse_args().out)
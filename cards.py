@@ -0,0 +1,272 @@
+# cards.py
+# Mode "carte de PR" : un seul message par PR et par destination, modifié (editMessageText)
+# à chaque review ou changement d'état. Les mises à jour rapprochées sont regroupées en une édition.
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from event import PullRequestCard
+from sender import Notification, NotificationQueue
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+PR_CARDS = os.getenv("PR_CARDS", "0") == "1"
+PR_CARDS_FILE = os.getenv("PR_CARDS_FILE", "pr_cards.db")
+PR_CARDS_MAX = int(os.getenv("PR_CARDS_MAX", "1000"))
+# Délai (s) pendant lequel les mises à jour d'une même PR sont regroupées
+PR_CARDS_DEBOUNCE = float(os.getenv("PR_CARDS_DEBOUNCE", "3"))
+# Envoi d'une carte considéré comme perdu (worker arrêté brutalement) après ce délai (s)
+PR_CARDS_SEND_TIMEOUT = float(os.getenv("PR_CARDS_SEND_TIMEOUT", "300"))
+# Intervalle (s) entre deux passes de maintenance : suppression des cartes au-delà de PR_CARDS_MAX
+# et envoi des cartes modifiées restées sans envoi (worker arrêté pendant le délai de regroupement)
+PR_CARDS_PRUNE_INTERVAL = float(os.getenv("PR_CARDS_PRUNE_INTERVAL", "60"))
+
+
+def _new_state() -> Dict[str, Any]:
+    return {"pr": {}, "reviews": {}, "destinations": [], "messages": {}, "sending": {}, "dirty": {}, "pending": False}
+
+
+# Index PR -> état de la carte et message_id par destination, borné (LRU) et conservé entre redémarrages.
+# SQLite fait foi : plusieurs workers voient les mêmes cartes, et les envois en cours y sont notés pour
+# qu'un seul worker à la fois envoie ou modifie le message d'une destination.
+# Une mise à jour reste "pending" jusqu'à ce qu'un worker réserve son envoi : elle est durable dès
+# l'acquittement de GitHub, sans passer par l'outbox. Chaque méthode est une transaction courte,
+# exécutée hors de la boucle asyncio par run().
+class PRCardIndex:
+    def __init__(self, path: str = PR_CARDS_FILE, max_size: int = PR_CARDS_MAX,
+                 send_timeout: float = PR_CARDS_SEND_TIMEOUT):
+        self.path = path
+        self.max_size = max_size
+        self.send_timeout = send_timeout
+        # Un seul thread pour toutes les opérations SQLite : la connexion n'est jamais partagée
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pr-cards")
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cards (
+                key TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                used_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cards_used_at ON cards (used_at)")
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # Exécute func(state) dans une transaction BEGIN IMMEDIATE : aucun autre worker ne peut modifier
+    # la carte entre la lecture et l'écriture
+    def _transaction(self, key: str, func, touch: bool = False):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT state FROM cards WHERE key = ?", (key,)).fetchone()
+            state = json.loads(row[0]) if row else None
+            if state is not None:
+                # Cartes enregistrées avant le suivi des envois en cours
+                state.setdefault("sending", {})
+                state.setdefault("dirty", {})
+            state, result = func(state)
+            if state is not None:
+                self._conn.execute("INSERT INTO cards (key, state, used_at) VALUES (?, ?, ?) "
+                                   "ON CONFLICT(key) DO UPDATE SET state = excluded.state"
+                                   + (", used_at = excluded.used_at" if touch else ""),
+                                   (key, json.dumps(state), time.time()))
+            self._conn.execute("COMMIT")
+            return result
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    # Fusionne l'évènement dans l'état de la carte
+    def merge(self, key: str, event_type: str, data: Dict[str, Any], destinations: List[Tuple[Any, Any]]):
+        def merge(state):
+            state = state or _new_state()
+            PullRequestCard.merge(state, event_type, data)
+            for chat_id, thread_id in destinations:
+                if [chat_id, thread_id] not in state["destinations"]:
+                    state["destinations"].append([chat_id, thread_id])
+            state["pending"] = True
+            return state, None
+        self._transaction(key, merge, touch=True)
+
+    # Réserve l'envoi pour les destinations sans envoi en cours, marque les autres "dirty" : la carte
+    # sera renvoyée par le worker qui termine l'envoi en cours. Retourne l'état et les destinations réservées.
+    def claim(self, key: str) -> Optional[Tuple[Dict[str, Any], List[List[Any]]]]:
+        def claim(state):
+            if state is None:
+                return None, None
+            now = time.time()
+            state["pending"] = False
+            claimed = []
+            for chat_id, thread_id in state["destinations"]:
+                destination = f"{chat_id}:{thread_id}"
+                if state["sending"].get(destination, 0) > now:
+                    state["dirty"][destination] = True
+                    continue
+                state["sending"][destination] = now + self.send_timeout
+                state["dirty"].pop(destination, None)
+                claimed.append([chat_id, thread_id])
+            return state, (state, claimed)
+        return self._transaction(key, claim)
+
+    # Fin de l'envoi d'une destination : enregistre le message_id et retourne True si la carte a changé
+    # entre-temps et doit être renvoyée
+    def release(self, key: str, destination: str, message_id: Optional[int]) -> bool:
+        def release(state):
+            if state is None:
+                return None, False
+            if message_id is not None:
+                state["messages"][destination] = message_id
+            state["sending"].pop(destination, None)
+            return state, state["dirty"].pop(destination, False)
+        return self._transaction(key, release)
+
+    # Les cartes les moins récemment mises à jour sont oubliées au-delà de max_size
+    def prune(self) -> int:
+        return self._conn.execute("DELETE FROM cards WHERE key IN (SELECT key FROM cards ORDER BY used_at DESC "
+                                  "LIMIT -1 OFFSET ?)", (self.max_size,)).rowcount
+
+    # Cartes modifiées avant before et pas encore envoyées, ou à renvoyer après un envoi en cours
+    def stale(self, before: float) -> List[str]:
+        return [key for key, in self._conn.execute(
+            "SELECT key FROM cards WHERE used_at <= ? "
+            "AND (json_extract(state, '$.pending') = 1 OR json_extract(state, '$.dirty') != '{}')", (before,))]
+
+    def size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    def close(self):
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown(wait=True)
+
+
+class PRCards:
+    def __init__(self, notifications: NotificationQueue, index: Optional[PRCardIndex] = None,
+                 debounce: float = PR_CARDS_DEBOUNCE, prune_interval: float = PR_CARDS_PRUNE_INTERVAL):
+        self.notifications = notifications
+        self.index = index or PRCardIndex()
+        self.debounce = debounce
+        self.prune_interval = prune_interval
+        self._flushes: Dict[str, asyncio.Task] = {}
+        # Envois en cours de ce worker, pour /stats ; ceux de tous les workers sont dans l'index
+        self._sending: Dict[Tuple[str, str], Optional[asyncio.Task]] = {}
+        self._pruner: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def card_key(data: Dict[str, Any]) -> Optional[str]:
+        number = data.get("pull_request", {}).get("number")
+        if number is None:
+            return None
+        return f"{data.get('repository', {}).get('full_name', '')}#{number}"
+
+    # Fusionne l'évènement dans l'état de la carte puis programme l'envoi ou l'édition
+    async def update(self, event_type: str, data: Dict[str, Any], destinations: List[Tuple[Any, Any]]) -> bool:
+        key = self.card_key(data)
+        if key is None:
+            return False
+        await self.index.run(self.index.merge, key, event_type, data, destinations)
+
+        task = self._flushes.get(key)
+        if task is None or task.done():
+            self._flushes[key] = asyncio.create_task(self._flush_later(key), name=f"pr-card-{key}")
+        return True
+
+    async def _flush_later(self, key: str):
+        await asyncio.sleep(self.debounce)
+        self._flushes.pop(key, None)
+        await self.flush(key)
+
+    async def flush(self, key: str):
+        claimed = await self.index.run(self.index.claim, key)
+        if not claimed or not claimed[1]:
+            return
+        state, destinations = claimed
+        text = await asyncio.to_thread(PullRequestCard(state).format_message)
+        for chat_id, thread_id in destinations:
+            destination = f"{chat_id}:{thread_id}"
+            notification = Notification(chat_id, thread_id, text)
+            notification.edit_message_id = state["messages"].get(destination)
+            self._sending[(key, destination)] = None
+            notification.on_done = lambda message_id, key=key, destination=destination: \
+                self._on_sent(key, destination, message_id)
+            if not await self.notifications.enqueue(notification):
+                logger.error("Carte %s pour %s refusée, file pleine", key, destination)
+                self._on_sent(key, destination, None)
+
+    # Appelé par le worker d'envoi : le message_id est enregistré par une tâche pour ne pas le bloquer
+    def _on_sent(self, key: str, destination: str, message_id: Optional[int]):
+        self._sending[(key, destination)] = asyncio.create_task(
+            self._release(key, destination, message_id), name=f"pr-card-{key}")
+
+    async def _release(self, key: str, destination: str, message_id: Optional[int]):
+        try:
+            dirty = await self.index.run(self.index.release, key, destination, message_id)
+        finally:
+            self._sending.pop((key, destination), None)
+        if dirty:
+            self._flushes[key] = asyncio.create_task(self.flush(key), name=f"pr-card-{key}")
+
+    # Envoie les cartes acquittées mais jamais envoyées : regroupement interrompu par un arrêt brutal, ou
+    # envoi dont le worker a disparu (après PR_CARDS_SEND_TIMEOUT). Les cartes en cours de regroupement
+    # dans un worker vivant sont plus récentes que le délai de regroupement et ne sont pas touchées.
+    async def _recover(self):
+        keys = await self.index.run(self.index.stale, time.time() - self.debounce)
+        keys = [key for key in keys if key not in self._flushes]
+        if keys:
+            logger.info("Envoi de %d cartes de PR en attente", len(keys))
+        for key in keys:
+            await self.flush(key)
+
+    async def _prune(self):
+        while True:
+            try:
+                await self._recover()
+                pruned = await self.index.run(self.index.prune)
+                if pruned:
+                    logger.info("%d cartes de PR oubliées", pruned)
+            except Exception as e:
+                logger.error("Erreur lors de la maintenance des cartes de PR : %s", e)
+            await asyncio.sleep(self.prune_interval)
+
+    # La première passe de maintenance envoie les cartes laissées en attente par le dernier arrêt
+    async def start(self):
+        self._pruner = asyncio.create_task(self._prune(), name="pr-cards-pruner")
+
+    # Cartes en attente du délai de regroupement
+    def pending(self) -> int:
+        return len(self._flushes)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {"cards": await self.index.run(self.index.size), "pending": self.pending(),
+                "in_flight": len(self._sending)}
+
+    # Met en file les mises à jour encore en attente du délai de regroupement, avant l'arrêt des workers
+    async def stop(self):
+        if self._pruner:
+            self._pruner.cancel()
+            await asyncio.gather(self._pruner, return_exceptions=True)
+            self._pruner = None
+        tasks = list(self._flushes.items())
+        self._flushes.clear()
+        for _, task in tasks:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+        for key, _ in tasks:
+            await self.flush(key)
+
+    # Après l'arrêt des workers d'envoi : les derniers message_id sont enregistrés avant la fermeture
+    async def close(self):
+        await asyncio.gather(*(task for task in self._sending.values() if task is not None), return_exceptions=True)
+        # Relances "dirty" créées par les dernières fins d'envoi : la file est arrêtée, elles sont abandonnées
+        for task in self._flushes.values():
+            task.cancel()
+        await asyncio.gather(*self._flushes.values(), return_exceptions=True)
+        self.index.close()
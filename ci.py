@@ -0,0 +1,195 @@
+# ci.py
+# Agrège les évènements de CI (workflow_run, check_run, check_suite) par commit : un seul message
+# par dépôt et head_sha, envoyé quand tous les jobs connus sont terminés puis modifié en cas de relance.
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from event import EVENT_CLASSES, CIEvent, CIStatusEvent
+from sender import Notification, NotificationQueue
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Attente (s) après le dernier job terminé, au cas où d'autres jobs du commit démarrent encore
+CI_SETTLE_DELAY = float(os.getenv("CI_SETTLE_DELAY", "10"))
+# Commit sans nouvel évènement depuis ce délai (s) : oublié, même si des jobs ne sont pas terminés
+CI_TTL = float(os.getenv("CI_TTL", "3600"))
+# Commit terminé et résumé envoyé : gardé ce délai (s) pour modifier le message si un job est relancé
+CI_FINISHED_TTL = float(os.getenv("CI_FINISHED_TTL", "600"))
+CI_MAX_COMMITS = int(os.getenv("CI_MAX_COMMITS", "1000"))
+
+
+class _CommitStatus:
+    def __init__(self, event: CIEvent, now: float):
+        self.data = {
+            "repository": event.repo,
+            "sender": event.sender,
+            "head_sha": event.head_sha(),
+            "branch": event.branch(),
+            "runs": {},
+        }
+        self.updated = now
+        self.deadline = now
+        self.destinations: List[Tuple[Any, Any]] = []
+        # message_id du résumé par destination
+        self.messages: Dict[str, int] = {}
+        # Envoi en cours par destination, "dirty" si le résumé a changé entre-temps
+        self.in_flight: Dict[str, str] = {}
+        # Ids des évènements gardés dans l'outbox, relâchés quand le résumé est en file
+        self.held: List[int] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def completed(self) -> bool:
+        return CIStatusEvent(self.data).status() != "pending"
+
+
+class CIAggregator:
+    def __init__(self, notifications: NotificationQueue, settle_delay: float = CI_SETTLE_DELAY, ttl: float = CI_TTL,
+                 finished_ttl: float = CI_FINISHED_TTL, max_commits: int = CI_MAX_COMMITS):
+        self.notifications = notifications
+        self.settle_delay = settle_delay
+        self.ttl = ttl
+        self.finished_ttl = finished_ttl
+        self.max_commits = max_commits
+        # Ordre d'insertion = ordre de dernière mise à jour, le plus ancien est évincé en premier
+        self.commits: Dict[Tuple[str, str], _CommitStatus] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        # Outbox du worker, ouverte au démarrage : les jobs reçus survivent à un arrêt brutal
+        self.outbox = None
+
+    def accepts(self, event) -> bool:
+        return isinstance(event, CIEvent)
+
+    def size(self) -> int:
+        return len(self.commits)
+
+    async def add(self, event: CIEvent, destinations: List[Tuple[Any, Any]], held_id: Optional[int] = None):
+        if held_id is None and self.outbox is not None:
+            held_id = await self.outbox.hold("ci", {"event_type": event.OBJECT, "data": event.data,
+                                                    "destinations": destinations})
+        key = (event.repo.get("full_name", "Unknown"), event.head_sha())
+        now = time.monotonic()
+        status = self.commits.pop(key, None) or _CommitStatus(event, now)
+        self.commits[key] = status
+        if held_id is not None:
+            status.held.append(held_id)
+        status.data["runs"][event.run_key()] = event.run()
+        status.data["branch"] = status.data["branch"] or event.branch()
+        status.updated = now
+        for destination in destinations:
+            if destination not in status.destinations:
+                status.destinations.append(destination)
+
+        while len(self.commits) > self.max_commits:
+            old_key = next(iter(self.commits))
+            self._forget(old_key, self.commits[old_key])
+
+        # Rien n'est envoyé tant qu'un job tourne, sauf pour mettre à jour un résumé déjà envoyé
+        if status.completed() or status.messages:
+            status.deadline = now + self.settle_delay
+            if status.task is None or status.task.done():
+                status.task = asyncio.create_task(self._wait_and_flush(key, status), name=f"ci-{key[0]}@{key[1][:7]}")
+
+    async def _wait_and_flush(self, key: Tuple[str, str], status: _CommitStatus):
+        while True:
+            delay = status.deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self._flush(key, status)
+
+    async def _flush(self, key: Tuple[str, str], status: _CommitStatus):
+        if not (status.completed() or status.messages):
+            return
+        try:
+            text = CIStatusEvent(status.data).format_message()
+        except Exception as e:
+            logger.error("Erreur lors du résumé CI de %s@%s : %s", key[0], key[1], e)
+            return
+        complete = True
+        for chat_id, thread_id in status.destinations:
+            destination = f"{chat_id}:{thread_id}"
+            if destination in status.in_flight:
+                status.in_flight[destination] = "dirty"
+                complete = False
+                continue
+            notification = Notification(chat_id, thread_id, text)
+            notification.edit_message_id = status.messages.get(destination)
+            status.in_flight[destination] = "sending"
+            notification.on_done = lambda message_id, destination=destination: \
+                self._on_sent(key, status, destination, message_id)
+            if not await self.notifications.enqueue(notification):
+                status.in_flight.pop(destination, None)
+                logger.error("Résumé CI de %s@%s pour %s refusé, file pleine", key[0], key[1], destination)
+        # Résumé en file pour toutes les destinations : les évènements n'ont plus à être rejoués.
+        # Sinon ils le sont au prochain _flush, relancé à la fin de l'envoi en cours.
+        if complete:
+            self._release(status)
+
+    def _release(self, status: _CommitStatus):
+        if self.outbox is not None:
+            self.outbox.release(status.held)
+        status.held = []
+
+    def _on_sent(self, key: Tuple[str, str], status: _CommitStatus, destination: str, message_id: Optional[int]):
+        in_flight = status.in_flight.pop(destination, None)
+        if message_id is not None:
+            status.messages[destination] = message_id
+        if in_flight == "dirty":
+            status.task = asyncio.create_task(self._flush(key, status), name=f"ci-{key[0]}@{key[1][:7]}")
+
+    def _forget(self, key: Tuple[str, str], status: _CommitStatus):
+        del self.commits[key]
+        self._release(status)
+        if status.task is not None:
+            status.task.cancel()
+        if not status.completed():
+            logger.info("CI de %s@%s oubliée avant la fin des jobs", key[0], key[1][:7])
+
+    # Oublie les commits terminés après finished_ttl et les autres après ttl
+    def evict(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        expired = []
+        for key, status in self.commits.items():
+            ttl = self.finished_ttl if status.completed() and status.messages else self.ttl
+            busy = status.in_flight or (status.task is not None and not status.task.done())
+            if now - status.updated > ttl and not busy:
+                expired.append((key, status))
+        for key, status in expired:
+            self._forget(key, status)
+        return len(expired)
+
+    async def _sweep(self):
+        interval = max(1.0, min(60.0, self.finished_ttl, self.ttl))
+        while True:
+            await asyncio.sleep(interval)
+            self.evict()
+
+    # Réagrège les évènements reçus avant le dernier arrêt dont le résumé n'était pas en file
+    async def start(self):
+        if self.outbox is not None:
+            held = await self.outbox.held("ci")
+            if held:
+                logger.info("Rejeu de %d évènements de CI", len(held))
+            for held_id, payload in held:
+                event = EVENT_CLASSES[payload["event_type"]](payload["data"])
+                await self.add(event, [tuple(destination) for destination in payload["destinations"]], held_id)
+        self._sweeper = asyncio.create_task(self._sweep(), name="ci-sweeper")
+
+    # Envoie immédiatement les résumés en attente du délai settle_delay (arrêt du bot)
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        pending = [(key, status) for key, status in self.commits.items()
+                   if status.task is not None and not status.task.done()]
+        for _, status in pending:
+            status.task.cancel()
+        await asyncio.gather(*(status.task for _, status in pending), return_exceptions=True)
+        for key, status in pending:
+            await self._flush(key, status)
@@ -0,0 +1,126 @@
+# coalesce.py
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from dotenv import load_dotenv
+
+from event import PushEvent, PushDigestEvent
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# 0 désactive le regroupement des push
+PUSH_COALESCE_WINDOW = float(os.getenv("PUSH_COALESCE_WINDOW", "0"))
+PUSH_COALESCE_MAX_DELAY = float(os.getenv("PUSH_COALESCE_MAX_DELAY", "60"))
+
+
+class _PushBatch:
+    def __init__(self, now: float):
+        self.first_seen = now
+        self.deadline = now
+        self.pushes = []
+        # Ids des push gardés dans l'outbox, relâchés quand le digest est en file
+        self.held = []
+        self.task = None
+
+
+# Regroupe les push d'un même dépôt/branche reçus dans une fenêtre de temps en un seul message
+class PushCoalescer:
+    def __init__(self, emit: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+                 window: float = PUSH_COALESCE_WINDOW, max_delay: float = PUSH_COALESCE_MAX_DELAY):
+        self.emit = emit
+        self.window = window
+        self.max_delay = max(max_delay, window)
+        self.batches: Dict[Tuple[str, str], _PushBatch] = {}
+        # Outbox du worker, ouverte au démarrage : les push en attente survivent à un arrêt brutal
+        self.outbox = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    # Les créations/suppressions de branche ne sont pas regroupées
+    def accepts(self, event) -> bool:
+        return (self.enabled and isinstance(event, PushEvent)
+                and not event.is_new_branch() and not event.is_deleted_branch())
+
+    async def add(self, data: Dict[str, Any], held_id: Optional[int] = None):
+        if held_id is None and self.outbox is not None:
+            held_id = await self.outbox.hold("push", data)
+        key = (data.get("repository", {}).get("full_name", "Unknown"), data.get("ref", ""))
+        now = time.monotonic()
+        batch = self.batches.get(key)
+        if batch is None:
+            batch = self.batches[key] = _PushBatch(now)
+            batch.task = asyncio.create_task(self._wait_and_flush(key, batch))
+        batch.pushes.append(data)
+        if held_id is not None:
+            batch.held.append(held_id)
+        # Chaque nouveau push repousse l'envoi, sans dépasser max_delay après le premier
+        batch.deadline = min(now + self.window, batch.first_seen + self.max_delay)
+
+    async def _wait_and_flush(self, key: Tuple[str, str], batch: _PushBatch):
+        while True:
+            delay = batch.deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self._flush(key, batch)
+
+    async def _flush(self, key: Tuple[str, str], batch: _PushBatch):
+        if self.batches.get(key) is batch:
+            del self.batches[key]
+        try:
+            event = self._merge(batch.pushes)
+            message = await asyncio.to_thread(event.format_message)
+            if not await self.emit(message, event.data):
+                logger.error("Digest de push pour %s non mis en file d'attente", key)
+        except Exception as e:
+            logger.error("Erreur lors de l'envoi du digest de push pour %s : %s", key, e)
+        # Digest en file et enregistré dans l'outbox, ou abandonné comme une notification refusée
+        if self.outbox is not None:
+            self.outbox.release(batch.held)
+
+    @staticmethod
+    def _merge(pushes):
+        if len(pushes) == 1:
+            return PushEvent(pushes[0])
+
+        authors = []
+        for push in pushes:
+            login = push.get("sender", {}).get("login", "Unknown")
+            if login not in authors:
+                authors.append(login)
+
+        last = pushes[-1]
+        head_commit = next((push.get("head_commit") for push in reversed(pushes) if push.get("head_commit")), None)
+        return PushDigestEvent({
+            "repository": last.get("repository", {}),
+            "sender": last.get("sender", {}),
+            "ref": last.get("ref", ""),
+            "head_commit": head_commit,
+            "push_count": len(pushes),
+            "commit_count": sum(PushEvent(push).count("commits") for push in pushes),
+            "authors": authors,
+        })
+
+    # Remet en attente les push reçus avant le dernier arrêt et pas encore envoyés
+    async def replay(self):
+        if self.outbox is None:
+            return
+        held = await self.outbox.held("push")
+        if held:
+            logger.info("Rejeu de %d push en attente de regroupement", len(held))
+        for held_id, data in held:
+            await self.add(data, held_id)
+
+    # Envoie immédiatement tous les digests en attente (arrêt du bot)
+    async def stop(self):
+        batches = list(self.batches.items())
+        for key, batch in batches:
+            batch.task.cancel()
+        await asyncio.gather(*(batch.task for _, batch in batches), return_exceptions=True)
+        for key, batch in batches:
+            await self._flush(key, batch)
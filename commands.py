@@ -1,12 +1,12 @@
 # commands.py
 import os
+import asyncio
 from user import UserManager
 from telegram.ext import ContextTypes
 from telegram import Update
 import logging
 from dotenv import load_dotenv
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -19,7 +19,7 @@ def restricted_to_thread(func):
         chat_id = update.effective_chat.id
         thread_id = getattr(update.message, 'message_thread_id', None)
         if str(chat_id) != str(CHAT_ID) or (THREAD_ID is not None and thread_id != THREAD_ID):
-            logger.warning(f"Accès refusé pour {update.effective_user.username} dans {chat_id}, topic {thread_id}")
+            logger.warning("Accès refusé pour %s dans %s, topic %s", update.effective_user.username, chat_id, thread_id)
             return
         return await func(update, context, *args, **kwargs)
     return wrapper
@@ -51,7 +51,7 @@ async def link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_username = update.message.from_user.username
 
     try:
-        UserManager.add_user(github_username, telegram_username)
+        await asyncio.to_thread(UserManager.add_user, github_username, telegram_username)
         await update.message.reply_text(f"Utilisateur {github_username} lié à @{telegram_username}")
     except ValueError as e:
         await update.message.reply_text(str(e))
@@ -67,7 +67,7 @@ async def unlink(update: Update, context: ContextTypes.DEFAULT_TYPE):
     github_username = context.args[0]
 
     try:
-        UserManager.remove_user(github_username)
+        await asyncio.to_thread(UserManager.remove_user, github_username)
         await update.message.reply_text(f"Utilisateur {github_username} délié")
     except Warning as e:
         await update.message.reply_text(str(e))
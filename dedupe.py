@@ -0,0 +1,53 @@
+# dedupe.py
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+from dotenv import load_dotenv
+
+load_dotenv()
+DEDUPE_MAX_SIZE = int(os.getenv("DEDUPE_MAX_SIZE", "10000"))
+DEDUPE_TTL = float(os.getenv("DEDUPE_TTL", "86400"))
+
+
+# Index borné (LRU + TTL) des identifiants X-GitHub-Delivery déjà traités
+class DeliveryCache:
+    def __init__(self, max_size: int = DEDUPE_MAX_SIZE, ttl: float = DEDUPE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self, now: float):
+        # Les entrées sont rangées par date d'insertion : on s'arrête à la première encore valide
+        while self.entries:
+            delivery_id, expires_at = next(iter(self.entries.items()))
+            if expires_at > now:
+                break
+            del self.entries[delivery_id]
+
+    # Retourne True si la livraison a déjà été vue, sinon l'enregistre.
+    # Coroutine comme shared.SharedDeliveryCache, dont les écritures passent par un thread.
+    async def check_and_add(self, delivery_id: str) -> bool:
+        now = time.monotonic()
+        self._expire(now)
+        if delivery_id in self.entries:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        self.entries[delivery_id] = now + self.ttl
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return False
+
+    # Oublie une livraison dont le traitement a échoué pour que GitHub puisse la renvoyer
+    async def discard(self, delivery_id: str):
+        self.entries.pop(delivery_id, None)
+
+    def size(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": self.size(), "hits": self.hits, "misses": self.misses}
@@ -1,46 +1,92 @@
 # event.py
 from abc import ABC, abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Union
 from user import UserManager
+from projection import COUNT, decode_projected, merge_projections
 from messages import (
-    format_push_message, format_pull_request_message, format_pull_request_review_message,
-    format_create_event_message, format_delete_event_message,
-    EMOJI_PR_REVIEW, escape_markdown
+    format_push_message, format_push_digest_message, format_pull_request_message, format_pull_request_review_message,
+    format_create_event_message, format_delete_event_message, format_pull_request_card, format_ci_summary_message,
+    EMOJI_PR_REVIEW, REVIEW_STATES, REVIEW_CARD_STATES
 )
 
+# Champs du payload utilisés par tous les évènements (filtres compris)
+BASE_PROJECTION = {
+    "action": True,
+    "repository": {"full_name": True, "html_url": True},
+    "sender": {"login": True, "html_url": True},
+}
+
 class GitHubEvent(ABC):
+    # Champs du payload dont la classe a besoin, en plus de BASE_PROJECTION
+    PROJECTION: Dict[str, Any] = {}
+
     def __init__(self, data: Dict[str, any]):
         self.data = data
         self.repo = data.get("repository", {})
         self.sender = data.get("sender", {})
         self.action = data.get("action", None)
+
+    # Décode le body brut en ne gardant que les champs déclarés dans PROJECTION
+    @classmethod
+    def decode(cls, raw_body: Union[bytes, str]) -> Dict[str, Any]:
+        projection = cls.__dict__.get("_projection")
+        if projection is None:
+            projection = merge_projections(BASE_PROJECTION, cls.PROJECTION)
+            cls._projection = projection
+        return decode_projected(raw_body, projection)
+
+    # Nombre d'éléments d'un tableau, qu'il soit complet ou déjà compté par la projection
+    def count(self, key: str) -> int:
+        value = self.data.get(key, [])
+        return value if isinstance(value, int) else len(value)
     
     @abstractmethod
     def format_message(self) -> str:
         pass
     
-    def get_info(self) -> Dict[str, Any]:
+    # Résout en une fois l'émetteur et les autres pseudos GitHub utiles au message
+    def resolve_users(self, *github_usernames: str) -> Dict[str, str]:
+        return UserManager.get_telegram_usernames([self.sender.get("login", "Unknown"), *github_usernames])
+
+    @staticmethod
+    def mention(users: Dict[str, str], github_username: str) -> str:
+        telegram_username = users.get(github_username)
+        return f"@{telegram_username}" if telegram_username else github_username
+
+    def get_info(self, users: Dict[str, str] = None) -> Dict[str, Any]:
         github_username = self.sender.get("login", "Unknown")
-        telegram_username = UserManager.get_telegram_username(github_username)
-        sender_username = f"@{telegram_username}" if telegram_username else github_username
+        if users is None:
+            users = self.resolve_users()
+        sender_username = self.mention(users, github_username)
 
         return {
-            "repo_name": escape_markdown(self.repo.get("full_name", "Unknown")),
+            "repo_name": self.repo.get("full_name", "Unknown"),
             "repo_url": self.repo.get("html_url", " "),
             "sender_username": sender_username,
             "sender_url": self.sender.get("html_url", " ")
         }
     
 class PushEvent(GitHubEvent):
+    PROJECTION = {
+        "ref": True, "created": True, "deleted": True, "before": True, "after": True,
+        "head_commit": {"message": True},
+        "commits": COUNT,
+    }
+
+    def is_new_branch(self) -> bool:
+        return self.data.get("created", False) and self.data.get("before", "").startswith("000")
+
+    def is_deleted_branch(self) -> bool:
+        return self.data.get("deleted", False) and self.data.get("after", "").startswith("000")
+
     def format_message(self) -> str:
         common_info = self.get_info()
-        ref = escape_markdown(self.data.get("ref", "").replace("refs/heads/", "").replace("refs/tags/", ""))
-        commits = self.data.get("commits", [])
-        commit_count = len(commits)
+        ref = self.data.get("ref", "").replace("refs/heads/", "").replace("refs/tags/", "")
+        commit_count = self.count("commits")
         head_commit = self.data.get("head_commit", {})
-        commit_message = escape_markdown(head_commit.get("message", "Aucun message") if head_commit else "Aucun message")
-        is_new_branch = self.data.get("created", False) and self.data.get("before", "").startswith("000")
-        is_deleted_branch = self.data.get("deleted", False) and self.data.get("after", "").startswith("000")
+        commit_message = head_commit.get("message", "Aucun message") if head_commit else "Aucun message"
+        is_new_branch = self.is_new_branch()
+        is_deleted_branch = self.is_deleted_branch()
 
         if is_new_branch:
             return format_create_event_message(
@@ -69,26 +115,51 @@ class PushEvent(GitHubEvent):
             repo_url=common_info['repo_url']
         )
 
+# Plusieurs push regroupés sur le même dépôt/branche (voir coalesce.py)
+class PushDigestEvent(GitHubEvent):
+    def format_message(self) -> str:
+        authors = self.data.get("authors", [])
+        users = self.resolve_users(*authors)
+        common_info = self.get_info(users)
+        ref = self.data.get("ref", "").replace("refs/heads/", "").replace("refs/tags/", "")
+        head_commit = self.data.get("head_commit", {})
+        commit_message = head_commit.get("message", "Aucun message") if head_commit else "Aucun message"
+
+        return format_push_digest_message(
+            repo_name=common_info['repo_name'],
+            ref=ref,
+            push_count=self.data.get("push_count", 1),
+            commit_count=self.data.get("commit_count", 0),
+            commit_message=commit_message,
+            authors_str=", ".join(self.mention(users, author) for author in authors),
+            repo_url=common_info['repo_url']
+        )
+
 class PullRequestEvent(GitHubEvent):
+    PROJECTION = {
+        "pull_request": {
+            "number": True, "title": True, "html_url": True, "draft": True, "state": True, "merged": True,
+            "requested_reviewers": [{"login": True}],
+            "user": {"login": True},
+            "head": {"ref": True},
+            "base": {"ref": True},
+        },
+    }
+
     def format_message(self) -> str:
-        common_info = self.get_info()
         pr = self.data.get("pull_request", {})
         pr_number = pr.get("number", "N/A")
-        pr_title = escape_markdown(pr.get("title", "Aucun titre"))
+        pr_title = pr.get("title", "Aucun titre")
         pr_url = pr.get("html_url", " ")
         pr_reviewers = pr.get("requested_reviewers", [])
 
         github_reviewers = [user.get("login") for user in pr_reviewers if user.get("login")]
-        telegram_reviewers = []
-        head_branch = escape_markdown(pr.get("head", {}).get("ref", "inconnue"))
-        base_branch = escape_markdown(pr.get("base", {}).get("ref", "inconnue"))
+        head_branch = pr.get("head", {}).get("ref", "inconnue")
+        base_branch = pr.get("base", {}).get("ref", "inconnue")
 
-        for github_user in github_reviewers:
-            tg_username = UserManager.get_telegram_username(github_user)
-            if tg_username:
-                telegram_reviewers.append(f"@{tg_username}")
-            else:
-                telegram_reviewers.append(github_user)
+        users = self.resolve_users(*github_reviewers)
+        common_info = self.get_info(users)
+        telegram_reviewers = [self.mention(users, github_user) for github_user in github_reviewers]
 
         pr_reviewers_str = ""
         if telegram_reviewers:
@@ -102,29 +173,37 @@ class PullRequestEvent(GitHubEvent):
             base_branch=base_branch,
             sender_username=common_info['sender_username'],
             pr_reviewers_str=pr_reviewers_str,
-            pr_url=pr_url
+            pr_url=pr_url,
+            repo_url=common_info['repo_url']
         )
     
 class PullRequestReviewEvent(GitHubEvent):
+    PROJECTION = {
+        "review": {"user": {"login": True}, "state": True, "body": True, "html_url": True},
+        "pull_request": {"number": True, "title": True, "html_url": True, "draft": True, "state": True,
+                         "requested_reviewers": [{"login": True}], "user": {"login": True},
+                         "head": {"ref": True}, "base": {"ref": True}},
+    }
+
     def format_message(self)->str:
-        common_info = self.get_info()
         review = self.data.get("review", {})
         pr = self.data.get("pull_request", {})
         reviewer_github = review.get("user", {}).get("login", "Unknown")
-        reviewer_telegram = UserManager.get_telegram_username(reviewer_github)
-        reviewer = f"@{reviewer_telegram}" if reviewer_telegram else reviewer_github
+        pr_author_github = pr.get("user", {}).get("login", "Unknown")
+        users = self.resolve_users(reviewer_github, pr_author_github)
+        reviewer = self.mention(users, reviewer_github)
 
         pr_number = pr.get("number", "N/A")
-        pr_title = escape_markdown(pr.get("title", "Aucun titre"))
+        pr_title = pr.get("title", "Aucun titre")
         pr_url = pr.get("html_url", " ")
-        pr_author_github = pr.get("user", {}).get("login", "Unknown")
-        pr_author_telegram = UserManager.get_telegram_username(pr_author_github)
-        pr_author = f"@{pr_author_telegram}" if pr_author_telegram else pr_author_github
+        pr_author = self.mention(users, pr_author_github)
 
         state = review.get("state", "commented").lower()
-        emoji, state_str = EMOJI_PR_REVIEW.get(state, (EMOJI_PR_REVIEW["default"], "**a fait une review sur**"))
+        if state not in REVIEW_STATES:
+            state = "default"
+        emoji, state_str = EMOJI_PR_REVIEW[state], REVIEW_STATES[state]
 
-        body = escape_markdown(review.get("body", ""))
+        body = review.get("body") or ""
 
         return format_pull_request_review_message(
             emoji=emoji,
@@ -137,11 +216,177 @@ class PullRequestReviewEvent(GitHubEvent):
             pr_url=pr_url
         )
     
+# Carte d'une PR (voir cards.py) : état cumulé des évènements pull_request et pull_request_review
+class PullRequestCard(GitHubEvent):
+    def __init__(self, state: Dict[str, Any]):
+        super().__init__({"repository": state.get("repository", {})})
+        self.state = state
+
+    # Met à jour l'état de la carte avec un évènement déjà décodé
+    @staticmethod
+    def merge(state: Dict[str, Any], event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        state["repository"] = data.get("repository", state.get("repository", {}))
+        pr = data.get("pull_request", {})
+        card = state["pr"]
+        for field in ("number", "title", "html_url", "draft", "state", "merged"):
+            if field in pr:
+                card[field] = pr[field]
+        if "user" in pr:
+            card["author"] = pr["user"].get("login", "Unknown")
+        if "head" in pr:
+            card["head"] = pr["head"].get("ref", "inconnue")
+        if "base" in pr:
+            card["base"] = pr["base"].get("ref", "inconnue")
+        if "requested_reviewers" in pr:
+            card["reviewers"] = [user.get("login") for user in pr["requested_reviewers"] if user.get("login")]
+
+        if event_type == "pull_request_review":
+            review = data.get("review", {})
+            reviewer = review.get("user", {}).get("login", "Unknown")
+            review_state = review.get("state", "commented").lower()
+            if review_state == "dismissed":
+                state["reviews"].pop(reviewer, None)
+            # Un simple commentaire ne remplace pas une approbation ou une demande de modifications
+            elif review_state != "commented" or state["reviews"].get(reviewer) in (None, "commented"):
+                state["reviews"][reviewer] = review_state
+        return state
+
+    def status(self) -> str:
+        pr = self.state["pr"]
+        if pr.get("merged"):
+            return "merged"
+        if pr.get("state") == "closed":
+            return "closed"
+        return "draft" if pr.get("draft") else "open"
+
+    def format_message(self) -> str:
+        pr = self.state["pr"]
+        reviews = self.state["reviews"]
+        pr_author_github = pr.get("author", "Unknown")
+        reviewers = pr.get("reviewers", [])
+        users = UserManager.get_telegram_usernames([pr_author_github, *reviewers, *reviews])
+        common_info = self.get_info(users)
+
+        review_lines = []
+        for reviewer, state in reviews.items():
+            if state not in REVIEW_CARD_STATES:
+                state = "default"
+            review_lines.append((EMOJI_PR_REVIEW[state], self.mention(users, reviewer), REVIEW_CARD_STATES[state]))
+
+        return format_pull_request_card(
+            repo_name=common_info['repo_name'],
+            repo_url=common_info['repo_url'],
+            pr_number=pr.get("number", "N/A"),
+            pr_title=pr.get("title", "Aucun titre"),
+            head_branch=pr.get("head", "inconnue"),
+            base_branch=pr.get("base", "inconnue"),
+            pr_author=self.mention(users, pr_author_github),
+            status=self.status(),
+            pr_reviewers_str=", ".join(self.mention(users, reviewer) for reviewer in reviewers),
+            reviews=review_lines,
+            pr_url=pr.get("html_url", " ")
+        )
+
+# Conclusions qui font échouer la CI d'un commit
+CI_FAILED_CONCLUSIONS = frozenset(["failure", "timed_out", "cancelled", "action_required", "startup_failure"])
+
+# Évènement de CI (workflow_run, check_run, check_suite), ramené à un job du commit testé.
+# Ces évènements arrivent en rafale : ils passent par ci.CIAggregator, qui envoie un résumé par commit.
+class CIEvent(GitHubEvent):
+    # Objet du payload qui décrit le job
+    OBJECT = ""
+
+    def __init__(self, data: Dict[str, Any]):
+        super().__init__(data)
+        self.obj = data.get(self.OBJECT, {})
+
+    def head_sha(self) -> str:
+        return self.obj.get("head_sha", "")
+
+    def branch(self) -> str:
+        return self.obj.get("head_branch") or ""
+
+    def name(self) -> str:
+        return self.obj.get("name", "inconnu")
+
+    # Job courant : (nom, conclusion, url), conclusion "pending" tant qu'il n'est pas terminé
+    def run(self):
+        if self.obj.get("status") != "completed":
+            conclusion = "pending"
+        else:
+            conclusion = self.obj.get("conclusion") or "neutral"
+        return (self.name(), conclusion, self.obj.get("html_url", " "))
+
+    # Clé du job dans le résumé : une relance remplace le job précédent du même nom
+    def run_key(self) -> str:
+        return f"{self.OBJECT}:{self.name()}"
+
+    def format_message(self) -> str:
+        return CIStatusEvent({
+            "repository": self.repo, "sender": self.sender, "head_sha": self.head_sha(), "branch": self.branch(),
+            "runs": {self.run_key(): self.run()},
+        }).format_message()
+
+class WorkflowRunEvent(CIEvent):
+    OBJECT = "workflow_run"
+    PROJECTION = {
+        "workflow_run": {"name": True, "head_sha": True, "head_branch": True, "status": True, "conclusion": True,
+                         "html_url": True},
+    }
+
+class CheckRunEvent(CIEvent):
+    OBJECT = "check_run"
+    PROJECTION = {
+        "check_run": {"name": True, "head_sha": True, "status": True, "conclusion": True, "html_url": True,
+                      "check_suite": {"head_branch": True}},
+    }
+
+    def branch(self) -> str:
+        return self.obj.get("check_suite", {}).get("head_branch") or ""
+
+class CheckSuiteEvent(CIEvent):
+    OBJECT = "check_suite"
+    PROJECTION = {
+        "check_suite": {"head_sha": True, "head_branch": True, "status": True, "conclusion": True,
+                        "app": {"name": True}},
+    }
+
+    # Une suite n'a ni nom ni page : on affiche l'application de CI et le dépôt
+    def name(self) -> str:
+        return self.obj.get("app", {}).get("name", "inconnu")
+
+    def run(self):
+        name, conclusion, _ = super().run()
+        return (name, conclusion, self.repo.get("html_url", " "))
+
+# Résumé des jobs de CI d'un commit, construit par ci.CIAggregator
+class CIStatusEvent(GitHubEvent):
+    def status(self) -> str:
+        conclusions = [conclusion for _, conclusion, _ in self.data.get("runs", {}).values()]
+        if "pending" in conclusions:
+            return "pending"
+        if any(conclusion in CI_FAILED_CONCLUSIONS for conclusion in conclusions):
+            return "failure"
+        return "success"
+
+    def format_message(self) -> str:
+        runs = sorted(self.data.get("runs", {}).values())
+        return format_ci_summary_message(
+            repo_name=self.repo.get("full_name", "Unknown"),
+            repo_url=self.repo.get("html_url", " "),
+            branch=self.data.get("branch", ""),
+            sha=self.data.get("head_sha", ""),
+            status=self.status(),
+            runs=runs
+        )
+
 class CreateEvent(GitHubEvent):
+    PROJECTION = {"ref": True, "ref_type": True}
+
     def format_message(self)->str:
         common_info = self.get_info()
         ref_type = self.data.get("ref_type")
-        ref = escape_markdown(self.data.get("ref", ""))
+        ref = self.data.get("ref", "")
 
         action = "Créé"
         if ref_type == "branch":
@@ -160,10 +405,12 @@ class CreateEvent(GitHubEvent):
         )
     
 class DeleteEvent(GitHubEvent):
+    PROJECTION = {"ref": True, "ref_type": True}
+
     def format_message(self):
         common_info = self.get_info()
         ref_type = self.data.get("ref_type")
-        ref = escape_markdown(self.data.get("ref", ""))
+        ref = self.data.get("ref", "")
 
         action = "Supprimé"
         if ref_type == "branch":
@@ -187,4 +434,7 @@ EVENT_CLASSES = {
     "pull_request_review": PullRequestReviewEvent,
     "create_branch_event" : CreateEvent,
     "delete_branch_event" : DeleteEvent,
+    "workflow_run": WorkflowRunEvent,
+    "check_run": CheckRunEvent,
+    "check_suite": CheckSuiteEvent,
 }
\ No newline at end of file
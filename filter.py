@@ -1,33 +1,209 @@
 # filter.py
-from typing import Dict, Any
+import os
+import re
+import json
+import time
+import fnmatch
+import logging
+import threading
+from typing import Dict, Any, Iterable, Optional, Pattern
+from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Règles par dépôt, rechargées à chaud quand le fichier change
+FILTERS_FILE = os.getenv("FILTERS_FILE", "filters.json")
+FILTERS_RELOAD_INTERVAL = float(os.getenv("FILTERS_RELOAD_INTERVAL", "5"))
+
+# Règles par défaut, appliquées à tous les dépôts
 FILTERS = {
-    "enabled_events": ["push", 
-                    "pull_request", 
-                    "pull_request_review", 
-                    "create_branch_event", 
-                    "delete_branch_event"],
-    
+    "enabled_events": ["push",
+                    "pull_request",
+                    "pull_request_review",
+                    "create_branch_event",
+                    "delete_branch_event",
+                    "workflow_run"],
+
     "pull_request_actions": ["opened",
                             "reopened"],
 
     "excluded_actions": ["synchronize"],
+
+    # Classe de priorité par type d'évènement, ou par action/état de review ("*" pour les autres).
+    # Les notifications "high" passent avant les autres, les "low" sont délestées si la file est chargée.
+    "priorities": {"pull_request_review": {"changes_requested": "high", "*": "normal"},
+                   "push": {"deleted": "low", "created": "low", "*": "normal"},
+                   "create_branch_event": "low",
+                   "delete_branch_event": "low"},
 }
 
-class MessageFilter:
-    def __init__(self):
-        self.filters = FILTERS
-    
-    def is_event_enabled(self, event_type: str, data: Dict[str, Any]) -> bool:
-        if event_type not in self.filters["enabled_events"]:
+# Classes de priorité, la plus petite valeur est envoyée en premier
+PRIORITY_LEVELS = {"high": 0, "normal": 1, "low": 2}
+PRIORITY_HIGH = PRIORITY_LEVELS["high"]
+PRIORITY_NORMAL = PRIORITY_LEVELS["normal"]
+PRIORITY_LOW = PRIORITY_LEVELS["low"]
+
+
+def _compile_globs(patterns: Optional[Iterable[str]]) -> Optional[Pattern]:
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+def _branch_name(ref: str) -> str:
+    return ref.replace("refs/heads/", "").replace("refs/tags/", "")
+
+
+# Branche de l'évènement : ref d'un push, branche cible d'une PR ou branche testée par la CI
+def event_branch(data: Dict[str, Any]) -> str:
+    ref = (data.get("ref")
+           or data.get("pull_request", {}).get("base", {}).get("ref")
+           or data.get("workflow_run", {}).get("head_branch")
+           or data.get("check_suite", {}).get("head_branch")
+           or data.get("check_run", {}).get("check_suite", {}).get("head_branch")
+           or "")
+    return _branch_name(ref)
+
+
+# Action utilisée pour la priorité : état de la review, création/suppression de branche pour un push, sinon action
+def event_action(event_type: str, data: Dict[str, Any]) -> str:
+    if event_type == "pull_request_review":
+        return data.get("review", {}).get("state", "").lower()
+    if event_type == "push":
+        return "deleted" if data.get("deleted") else "created" if data.get("created") else ""
+    return data.get("action", "")
+
+
+def _compile_priorities(priorities: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    compiled = {}
+    for event_type, value in priorities.items():
+        value = value if isinstance(value, dict) else {"*": value}
+        compiled[event_type] = {action: PRIORITY_LEVELS[level] for action, level in value.items()}
+    return compiled
+
+
+# Règle d'un dépôt compilée une seule fois : ensembles et regex précompilées
+class CompiledRule:
+    def __init__(self, rule: Dict[str, Any]):
+        self.enabled_events = frozenset(rule.get("enabled_events", []))
+        self.pull_request_actions = frozenset(rule.get("pull_request_actions", []))
+        self.excluded_actions = frozenset(rule.get("excluded_actions", []))
+        self.branches = _compile_globs(rule.get("branches"))
+        self.excluded_branches = _compile_globs(rule.get("excluded_branches"))
+        self.senders = frozenset(s.lower() for s in rule.get("senders", []))
+        self.excluded_senders = frozenset(s.lower() for s in rule.get("excluded_senders", []))
+        self.draft_pull_requests = rule.get("draft_pull_requests", True)
+        self.priorities = _compile_priorities(rule.get("priorities", {}))
+
+    def priority(self, event_type: str, data: Dict[str, Any]) -> int:
+        levels = self.priorities.get(event_type)
+        if not levels:
+            return PRIORITY_NORMAL
+        return levels.get(event_action(event_type, data), levels.get("*", PRIORITY_NORMAL))
+
+    def matches(self, event_type: str, data: Dict[str, Any]) -> bool:
+        if event_type not in self.enabled_events:
             return False
-        
+
         action = data.get("action", "")
         if event_type == "pull_request":
-            if action not in self.filters.get("pull_request_actions", []):
+            if action not in self.pull_request_actions:
+                return False
+            if not self.draft_pull_requests and data.get("pull_request", {}).get("draft", False):
                 return False
-        if action in self.filters["excluded_actions"]:
+        if action in self.excluded_actions:
             return False
-        
+
+        if self.senders or self.excluded_senders:
+            sender = data.get("sender", {}).get("login", "").lower()
+            if self.senders and sender not in self.senders:
+                return False
+            if sender in self.excluded_senders:
+                return False
+
+        if self.branches or self.excluded_branches:
+            branch = event_branch(data)
+            if self.branches and not self.branches.match(branch):
+                return False
+            if self.excluded_branches and self.excluded_branches.match(branch):
+                return False
+
         return True
 
+
+# Ensemble des règles : dépôt exact ("org/repo"), puis organisation ("org/*"), puis défaut
+class CompiledFilters:
+    def __init__(self, config: Dict[str, Any]):
+        defaults = {**FILTERS, **config.get("default", {})}
+        self.default = CompiledRule(defaults)
+        self.rules: Dict[str, CompiledRule] = {}
+        for repo, rule in config.get("repositories", {}).items():
+            self.rules[repo.lower()] = CompiledRule({**defaults, **rule})
+
+        self.all_enabled_events = frozenset(self.default.enabled_events).union(
+            *(rule.enabled_events for rule in self.rules.values()))
+
+    def rule_for(self, repo_full_name: str) -> CompiledRule:
+        repo = repo_full_name.lower()
+        rule = self.rules.get(repo)
+        if rule is None:
+            rule = self.rules.get(f"{repo.split('/', 1)[0]}/*", self.default)
+        return rule
+
+
+class MessageFilter:
+    def __init__(self, filters_file: str = FILTERS_FILE, reload_interval: float = FILTERS_RELOAD_INTERVAL):
+        self.filters_file = filters_file
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked_at = 0.0
+        self.compiled = CompiledFilters({})
+        self.reload()
+
+    @property
+    def filters(self) -> Dict[str, Any]:
+        return FILTERS
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.filters_file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    # Recompile les règles si le fichier a changé ; en cas d'erreur on garde les anciennes
+    def reload(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return
+            self._stamp = stamp
+            try:
+                if stamp is None:
+                    config = {}
+                else:
+                    with open(self.filters_file, "r") as f:
+                        config = json.load(f)
+                self.compiled = CompiledFilters(config)
+                logger.info("Filtres chargés : %d règles par dépôt", len(self.compiled.rules))
+            except (OSError, ValueError, TypeError, AttributeError, KeyError) as e:
+                logger.error("Filtres invalides dans %s, anciennes règles conservées : %s", self.filters_file, e)
+
+    def _current(self) -> CompiledFilters:
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self.compiled
+
+    def is_event_type_enabled(self, event_type: str) -> bool:
+        return event_type in self._current().all_enabled_events
+
+    def is_event_enabled(self, event_type: str, data: Dict[str, Any]) -> bool:
+        repo = data.get("repository", {}).get("full_name", "")
+        return self._current().rule_for(repo).matches(event_type, data)
+
+    def priority(self, event_type: str, data: Dict[str, Any]) -> int:
+        repo = data.get("repository", {}).get("full_name", "")
+        return self._current().rule_for(repo).priority(event_type, data)
@@ -0,0 +1,153 @@
+# logs.py
+# Configuration des logs : les handlers (écriture sur stderr) tournent dans un thread à part via
+# QueueHandler/QueueListener, la boucle asyncio ne fait que mettre l'enregistrement en file.
+import os
+import re
+import sys
+import json
+import atexit
+import logging
+import logging.handlers
+from queue import SimpleQueue
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" ou "json" (une ligne JSON par enregistrement)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Les lignes INFO marquées SAMPLED ne sont écrites qu'une fois sur N, 1 pour tout garder
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "10"))
+# Taille max (octets) d'un payload ou d'un message recopié dans les logs DEBUG
+LOG_DUMP_MAX_BYTES = int(os.getenv("LOG_DUMP_MAX_BYTES", "2048"))
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# À passer en extra= aux lignes INFO répétées à chaque requête
+SAMPLED = {"sampled": True}
+# Champs ajoutés à tous les logs de la requête en cours (delivery_id, event_type)
+log_context: ContextVar[Dict[str, Any]] = ContextVar("log_context", default={})
+
+# Jetons de bot Telegram (123456:ABC...), y compris dans les URL de l'API loguées par httpx
+TELEGRAM_TOKEN_PATTERN = r"\d{5,}:[A-Za-z0-9_-]{30,}"
+# En dessous, un secret remplacé partout dans les logs les rendrait illisibles
+MIN_SECRET_LENGTH = 6
+REDACTED = "***"
+
+
+# Payload ou texte affiché tronqué, converti en chaîne seulement si la ligne est écrite
+class Dump:
+    def __init__(self, value: Any, limit: int = LOG_DUMP_MAX_BYTES):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        value = self.value
+        if isinstance(value, (bytes, bytearray)):
+            size = len(value)
+            text = bytes(value[:self.limit]).decode("utf-8", "replace")
+        else:
+            text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+            size = len(text)
+            text = text[:self.limit]
+        return text if size <= self.limit else f"{text}… ({size} au total)"
+
+
+# Garde une ligne sur every par message (format avant substitution), warnings et erreurs toujours gardés
+class SamplingFilter(logging.Filter):
+    def __init__(self, every: int = LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.every = max(1, every)
+        self.counts: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1 or record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        count = self.counts.get(record.msg, 0)
+        self.counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+# Recopie le contexte de la requête dans l'enregistrement, côté appelant : le thread
+# du QueueListener ne voit pas les ContextVar de la tâche asyncio
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in log_context.get().items():
+            setattr(record, key, value)
+        return True
+
+
+class Redactor:
+    def __init__(self, secrets=()):
+        patterns = [re.escape(s) for s in secrets if s and len(s) >= MIN_SECRET_LENGTH]
+        self.pattern = re.compile("|".join([TELEGRAM_TOKEN_PATTERN, *patterns]))
+
+    def __call__(self, text: str) -> str:
+        return self.pattern.sub(REDACTED, text)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, redact: Redactor):
+        super().__init__(TEXT_FORMAT)
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        context = " ".join(str(getattr(record, key)) for key in ("event_type", "delivery_id") if hasattr(record, key))
+        if context:
+            text = f"{text} [{context}]"
+        return self.redact(text)
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact: Redactor):
+        super().__init__()
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        # La trace d'une exception est déjà dans le message (QueueHandler.prepare)
+        for key in ("delivery_id", "event_type"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        return self.redact(json.dumps(entry, ensure_ascii=False))
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+# Remplace les handlers du logger racine par un QueueHandler ; un seul appel par process
+def setup_logging(secrets=(), level: str = LOG_LEVEL, log_format: str = LOG_FORMAT,
+                  sample_every: int = LOG_SAMPLE_EVERY) -> logging.handlers.QueueListener:
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    redact = Redactor(secrets)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter(redact) if log_format == "json" else TextFormatter(redact))
+
+    queue = SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(queue)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx écrit une ligne INFO par appel à l'API Telegram, gardée seulement en DEBUG
+    if logging.getLevelName(level) != logging.DEBUG:
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(queue, stream, respect_handler_level=True)
+    _listener.start()
+    # Les derniers enregistrements sont écrits avant la sortie du process
+    atexit.register(_listener.stop)
+    return _listener
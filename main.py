@@ -1,89 +1,348 @@
 # main.py
+import time
+# Début du chargement, pour le rapport de démarrage
+STARTED_AT = time.perf_counter()
 import os
+import sys
+import asyncio
 from contextlib import asynccontextmanager
 from http import HTTPStatus
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi.responses import PlainTextResponse
 from telegram import Update
 from telegram.ext import Application, CommandHandler
 import uvicorn
 import logging
 import hmac
+import hashlib
 
 from commands import start, get_chat_id, link, unlink
+from user import UserManager
 
-from webhooks import receive_github_webhook, process_telegram_update
+from webhooks import receive_github_webhook, process_telegram_update, dispatch_message, message_filter, COMMAND_UPDATE_TYPES
+from sender import NotificationQueue
+from ratelimit import SendScheduler
+from coalesce import PushCoalescer
+from dedupe import DeliveryCache
+from routing import Router
+from outbox import Outbox, OUTBOX_FILE
+from telegram_http import PooledRequest, ConnectionWarmer
+from cards import PR_CARDS, PRCards, PRCardIndex
+from ci import CIAggregator
+from shedding import LoadShedder
+from logs import setup_logging
+from profiling import DEBUG_TOKEN, DEBUG_TOKEN_HEADER, DeliveryProfiler, SamplingProfiler, is_debug_token
+from signatures import secret_table
+from shared import WEB_WORKERS, SharedDatabase, SharedBuckets, SharedDeliveryCache, claim_worker_slot, slot_file
+import metrics
+
+IMPORTS_DONE_AT = time.perf_counter()
+# Avec plusieurs workers, multiprocessing charge d'abord ce fichier sous le nom __mp_main__ avant
+# qu'uvicorn importe main : c'est ce premier chargement qui paie les imports
+_first_load = sys.modules.get("__mp_main__")
+if _first_load is not None and hasattr(_first_load, "IMPORTS_DONE_AT"):
+    STARTED_AT, IMPORTS_DONE_AT = _first_load.STARTED_AT, _first_load.IMPORTS_DONE_AT
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 WEBHOOK_DOMAIN = os.getenv("WEBHOOK_DOMAIN")
-GITHUB_SECRET = os.getenv("GITHUB_SECRET")
 CHAT_ID = os.getenv("CHAT_ID")
 THREAD_ID = os.getenv("THREAD_ID")
 THREAD_ID = int(THREAD_ID) if THREAD_ID is not None else None
+# Autre serveur de l'API Bot (serveur local ou faux serveur des benchmarks)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Attente max (s) du démarrage du bot avant de répondre 503 à une update Telegram
+TELEGRAM_READY_TIMEOUT = float(os.getenv("TELEGRAM_READY_TIMEOUT", "5"))
+# Updates Telegram traitées en parallèle par l'Application
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "8"))
+# Secret envoyé par Telegram avec chaque update (header X-Telegram-Bot-Api-Secret-Token),
+# dérivé du token du bot s'il n'est pas fourni
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or (
+    hmac.new(TELEGRAM_BOT_TOKEN.encode("utf-8"), b"telegram-webhook", hashlib.sha256).hexdigest()
+    if TELEGRAM_BOT_TOKEN else None)
+
+# Écriture des logs hors de la boucle asyncio, secrets masqués ; un seul appel effectif par process
+def configure_logging():
+    setup_logging(secrets=[TELEGRAM_BOT_TOKEN, TELEGRAM_WEBHOOK_SECRET, DEBUG_TOKEN, *secret_table().secrets()])
+
+def check_config():
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN non défini dans .env")
+    if not WEBHOOK_DOMAIN:
+        raise ValueError("WEBHOOK_DOMAIN non défini dans .env")
+    # Secrets des webhooks GitHub (GITHUB_SECRET et GITHUB_SECRETS_FILE), chargés une fois pour tout le process
+    if not secret_table():
+        raise ValueError("GITHUB_SECRET non défini dans .env (ni GITHUB_SECRETS_FILE)")
+    if not CHAT_ID:
+        raise ValueError("CHAT_ID non défini dans .env")
+    if not THREAD_ID:
+        raise ValueError("THREAD_ID non défini dans .env")
+
+def log_config():
+    github_secrets = secret_table()
+    logger.info("Webhook URL : %s", WEBHOOK_DOMAIN)
+    logger.info("Chat ID : %s", CHAT_ID)
+    logger.info("Thread ID : %s", THREAD_ID)
+    if github_secrets.hooks or github_secrets.targets:
+        logger.info("Secrets GitHub : %d hooks, %d dépôts/organisations", len(github_secrets.hooks), len(github_secrets.targets))
+
+def elapsed_ms() -> int:
+    return round((time.perf_counter() - STARTED_AT) * 1000)
+
+# Construit le bot et l'app FastAPI. Appelé une seule fois par process : directement avec un seul worker,
+# par uvicorn (factory) dans chaque worker sinon. L'import de main.py n'a pas d'effet de bord.
+def create_app() -> FastAPI:
+    configure_logging()
+    check_config()
+    # Mapping GitHub -> Telegram, avec la migration de users.json vers SQLite au premier lancement
+    UserManager.open_store()
+
+    # Création du bot telegram
+    telegram_request = PooledRequest()
+    builder = (Application.builder().token(TELEGRAM_BOT_TOKEN).updater(None).request(telegram_request)
+               .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    tg_bot = builder.build()
+    warmer = ConnectionWarmer(tg_bot.bot, telegram_request)
+
+    # Avec plusieurs workers, budgets d'envoi et livraisons déjà traitées sont partagés via SQLite
+    shared_db = SharedDatabase() if WEB_WORKERS > 1 else None
+
+    # File d'attente des notifications GitHub vers Telegram.
+    # L'outbox est ouverte au démarrage du worker, son fichier dépend du slot obtenu.
+    scheduler = SendScheduler(shared=SharedBuckets(shared_db) if shared_db else None)
+    outbox = None
+    notifications = NotificationQueue(tg_bot, scheduler)
+    deliveries = SharedDeliveryCache(shared_db) if shared_db else DeliveryCache()
+    router = Router((CHAT_ID, THREAD_ID))
+    coalescer = PushCoalescer(
+        lambda message, data: dispatch_message(message, notifications, router.destinations("push", data),
+                                               message_filter.priority("push", data))
+    )
+    # Un résumé par commit pour les évènements de CI
+    ci = CIAggregator(notifications)
+    # Un message par PR, modifié à chaque mise à jour (PR_CARDS=1)
+    cards = PRCards(notifications, PRCardIndex()) if PR_CARDS else None
+    # Évènements de faible priorité délestés quand la file d'envoi est chargée
+    shedder = LoadShedder(notifications)
+
+    # Profondeur des files, lue au moment du scrape
+    metrics.QUEUE_DEPTH.labels("send").set_function(notifications.qsize)
+    metrics.QUEUE_DEPTH.labels("rate_limit").set_function(lambda: sum(scheduler.waiting.values()))
+    metrics.QUEUE_DEPTH.labels("coalesce").set_function(lambda: len(coalescer.batches))
+    metrics.QUEUE_DEPTH.labels("deliveries").set_function(deliveries.size)
+    metrics.QUEUE_DEPTH.labels("ci").set_function(ci.size)
+    metrics.QUEUE_DEPTH.labels("shed").set_function(shedder.size)
+    metrics.QUEUE_DEPTH.labels("telegram_updates").set_function(tg_bot.update_queue.qsize)
+    if cards:
+        metrics.QUEUE_DEPTH.labels("pr_cards").set_function(cards.pending)
+
+    # Diagnostic à la demande (DEBUG_TOKEN) : profils de livraisons, livraisons lentes, profil du process
+    delivery_profiler = DeliveryProfiler()
+    sampling_profiler = SamplingProfiler()
+
+    # Durées du démarrage en ms, depuis le début du chargement de main.py
+    startup_report = {"imports_ms": round((IMPORTS_DONE_AT - STARTED_AT) * 1000)}
+    # Positionné quand le bot Telegram est initialisé : les envois et les updates Telegram l'attendent
+    telegram_ready = asyncio.Event()
 
-if not TELEGRAM_BOT_TOKEN:
-    raise ValueError("TELEGRAM_BOT_TOKEN non défini dans .env")
-if not WEBHOOK_DOMAIN:
-    raise ValueError("WEBHOOK_DOMAIN non défini dans .env")
-if not GITHUB_SECRET:
-    raise ValueError("GITHUB_SECRET non défini dans .env")
-if not CHAT_ID:
-    raise ValueError("CHAT_ID non défini dans .env")
-if not THREAD_ID:
-    raise ValueError("THREAD_ID non défini dans .env")
-
-logger.info(f"Token Telegram : {TELEGRAM_BOT_TOKEN}")
-logger.info(f"Webhook URL : {WEBHOOK_DOMAIN}")
-logger.info(f"Chat ID : {CHAT_ID}")
-logger.info(f"Thread ID : {THREAD_ID}")
-
-# Création du bot telegram
-tg_bot = (
-    Application.builder()
-    .token(TELEGRAM_BOT_TOKEN)
-    .updater(None)
-    .build()
-)
-
-# Gestion du cycle de vie du bot dans l'app FastAPI
-@asynccontextmanager
-async def lifespan(_: FastAPI):
-    webhook_url = f"{WEBHOOK_DOMAIN}/telegram"
-    logger.info(f"Configuration du webhook : {webhook_url}")
-    await tg_bot.bot.setWebhook(url=webhook_url)
-    async with tg_bot:
+    # N'enregistre le webhook que s'il a changé, pour éviter un appel réseau à chaque redémarrage.
+    # getWebhookInfo ne renvoie pas le secret : une empreinte dans l'URL signale qu'il a changé.
+    async def register_webhook():
+        fingerprint = hashlib.sha256(TELEGRAM_WEBHOOK_SECRET.encode("utf-8")).hexdigest()[:8]
+        webhook_url = f"{WEBHOOK_DOMAIN}/telegram?v={fingerprint}"
+        allowed_updates = list(COMMAND_UPDATE_TYPES)
+        info = await tg_bot.bot.get_webhook_info()
+        if info.url == webhook_url and sorted(info.allowed_updates or []) == sorted(allowed_updates):
+            logger.info("Webhook déjà configuré : %s", webhook_url)
+            return
+        logger.info("Configuration du webhook : %s", webhook_url)
+        # Telegram n'envoie que les types d'update traités par les commandes
+        await tg_bot.bot.setWebhook(url=webhook_url, secret_token=TELEGRAM_WEBHOOK_SECRET,
+                                    allowed_updates=allowed_updates)
+
+    # Initialisation côté Telegram, pendant que /webhook accepte déjà les livraisons GitHub
+    async def start_telegram(slot: int):
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                await tg_bot.initialize()
+                # Un seul worker (le slot 0) enregistre le webhook Telegram
+                if slot == 0:
+                    await register_webhook()
+                else:
+                    logger.info("Worker %d : webhook laissé au worker 0", slot)
+                break
+            except Exception as e:
+                attempt += 1
+                delay = min(60, 2 ** attempt)
+                logger.error("Initialisation Telegram impossible : %s, nouvel essai dans %ds", e, delay)
+                await asyncio.sleep(delay)
         await tg_bot.start()
-        logger.info("Bot Telegram démarré")
+        await warmer.start()
+        telegram_ready.set()
+        startup_report["telegram_init_ms"] = round((time.perf_counter() - started) * 1000)
+        startup_report["telegram_ready_ms"] = elapsed_ms()
+        logger.info("Bot Telegram démarré : initialisation %d ms, prêt %d ms après le lancement",
+                    startup_report["telegram_init_ms"], startup_report["telegram_ready_ms"])
+
+    # Gestion du cycle de vie du bot dans l'app FastAPI
+    @asynccontextmanager
+    async def lifespan(_: FastAPI):
+        nonlocal outbox
+        startup_report["init_ms"] = elapsed_ms() - startup_report["imports_ms"]
+        slot = claim_worker_slot()
+        if OUTBOX_FILE:
+            outbox = notifications.outbox = coalescer.outbox = ci.outbox = Outbox(slot_file(OUTBOX_FILE, slot))
+            await outbox.start()
+        await notifications.start(telegram_ready)
+        await notifications.replay()
+        await coalescer.replay()
+        await ci.start()
+        await shedder.start()
+        if cards:
+            await cards.start()
+        telegram_task = asyncio.create_task(start_telegram(slot), name="telegram-startup")
+        startup_report["webhook_ready_ms"] = elapsed_ms()
+        logger.info("Démarrage : imports %d ms, initialisation %d ms, webhooks GitHub acceptés %d ms après le lancement",
+                    startup_report["imports_ms"], startup_report["init_ms"], startup_report["webhook_ready_ms"])
         yield
-        await tg_bot.stop()
+        telegram_task.cancel()
+        await asyncio.gather(telegram_task, return_exceptions=True)
+        await coalescer.stop()
+        await ci.stop()
+        if cards:
+            await cards.stop()
+        await shedder.stop()
+        await notifications.stop()
+        if cards:
+            await cards.close()
+        await warmer.stop()
+        sampling_profiler.stop()
+        if outbox:
+            await outbox.stop()
+        if shared_db:
+            shared_db.close()
+        if tg_bot.running:
+            await tg_bot.stop()
+        await tg_bot.shutdown()
         logger.info("Bot Telegram arrêté")
 
-app = FastAPI(lifespan=lifespan)
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/telegram")
+    async def telegram_webhook_endpoint(request: Request):
+        # Telegram renverra l'update plus tard si le bot n'est pas encore prêt
+        try:
+            await asyncio.wait_for(telegram_ready.wait(), timeout=TELEGRAM_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail="Bot Telegram en cours de démarrage")
+        return await process_telegram_update(request, tg_bot, TELEGRAM_WEBHOOK_SECRET)
+
+    @app.post("/webhook")
+    async def github_webhook_endpoint(request: Request):
+        return await delivery_profiler.track(
+            request, lambda: receive_github_webhook(request, notifications, coalescer, deliveries, router, cards, ci,
+                                                  shedder))
+
+    # État de la file d'envoi et du rate limit Telegram
+    @app.get("/stats")
+    async def stats_endpoint():
+        stats = {**notifications.stats(), "deliveries": deliveries.stats(), "ci_commits": ci.size(),
+                 "shed_pending": shedder.size(), "startup": startup_report}
+        if cards:
+            stats["pr_cards"] = await cards.stats()
+        return stats
+
+    # Métriques au format Prometheus
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    # Endpoints /debug : 404 sans DEBUG_TOKEN, 401 sans le bon header X-Debug-Token
+    def require_debug_token(request: Request):
+        if not DEBUG_TOKEN:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND)
+        if not is_debug_token(request.headers.get(DEBUG_TOKEN_HEADER)):
+            raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Token de debug invalide")
+
+    # Les livraisons GitHub les plus lentes, avec la durée de chaque étape
+    @app.get("/debug/slow")
+    async def debug_slow_endpoint(request: Request):
+        require_debug_token(request)
+        return delivery_profiler.slow.snapshot()
+
+    @app.get("/debug/profiles")
+    async def debug_profiles_endpoint(request: Request):
+        require_debug_token(request)
+        return delivery_profiler.list()
+
+    # Profil d'une livraison : rapport texte, ou format=prof pour pstats/snakeviz
+    @app.get("/debug/profiles/{profile_id}")
+    async def debug_profile_detail_endpoint(request: Request, profile_id: int, format: str = "text"):
+        require_debug_token(request)
+        profile = delivery_profiler.get(profile_id)
+        if profile is None:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Profil inconnu")
+        if format == "prof":
+            return Response(delivery_profiler.dump(profile), media_type="application/octet-stream",
+                            headers={"Content-Disposition": f'attachment; filename="delivery-{profile_id}.prof"'})
+        return PlainTextResponse(delivery_profiler.report(profile))
+
+    # Lance un profil de tout le process pendant seconds (borné par PROFILE_MAX_SECONDS)
+    @app.post("/debug/profile")
+    async def debug_profile_start_endpoint(request: Request, seconds: float = 10, interval_ms: float = 5):
+        require_debug_token(request)
+        if not sampling_profiler.start(seconds, interval_ms / 1000):
+            raise HTTPException(status_code=HTTPStatus.CONFLICT, detail="Profil déjà en cours")
+        return sampling_profiler.status()
+
+    # État du profil en cours, ou résultat du dernier au format "collapsed stacks"
+    @app.get("/debug/profile")
+    async def debug_profile_endpoint(request: Request):
+        require_debug_token(request)
+        if sampling_profiler.running or sampling_profiler.started_at is None:
+            return sampling_profiler.status()
+        return PlainTextResponse(sampling_profiler.collapsed(),
+                                 headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'})
 
-@app.post("/telegram")
-async def telegram_webhook_endpoint(request: Request):
-    return await process_telegram_update(request, tg_bot)
+    # Arrête le profil avant la fin prévue et renvoie le résultat
+    @app.delete("/debug/profile")
+    async def debug_profile_stop_endpoint(request: Request):
+        require_debug_token(request)
+        await asyncio.to_thread(sampling_profiler.stop)
+        return PlainTextResponse(sampling_profiler.collapsed(),
+                                 headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'})
 
-@app.post("/webhook")
-async def github_webhook_endpoint(request: Request):
-    return await receive_github_webhook(request, tg_bot)
+    # Ajout des commandes au bot telegram
+    tg_bot.add_handler(CommandHandler("start", start))
+    tg_bot.add_handler(CommandHandler("get_chat_id", get_chat_id))
+    tg_bot.add_handler(CommandHandler("link", link))
+    tg_bot.add_handler(CommandHandler("unlink", unlink))
 
-# Ajout des commandes au bot telegram
-tg_bot.add_handler(CommandHandler("start", start))
-tg_bot.add_handler(CommandHandler("get_chat_id", get_chat_id))
-tg_bot.add_handler(CommandHandler("link", link))
-tg_bot.add_handler(CommandHandler("unlink", unlink))
+    return app
 
 # Démarre le serveur FastAPI
 if __name__ == "__main__":
+    configure_logging()
+    check_config()
+    log_config()
     logger.info("Démarrage du serveur FastAPI")
+    # Chaque worker construit sa propre app avec create_app.
+    # log_config=None : les logs d'uvicorn passent par le QueueHandler de setup_logging ; pas de log
+    # d'accès, une ligne écrite par requête (les webhooks ont déjà leurs lignes échantillonnées)
     uvicorn.run(
-        app,
+        "main:create_app" if WEB_WORKERS > 1 else create_app(),
+        factory=WEB_WORKERS > 1,
         host="0.0.0.0",
         port=8080,
-        log_level="info"
+        workers=WEB_WORKERS,
+        log_level="info",
+        log_config=None,
+        access_log=False
     )
\ No newline at end of file
@@ -1,4 +1,7 @@
 # messages.py
+from functools import lru_cache
+from render import Template, escape, truncate, CODE, MESSAGE_PARSE_MODE
+
 EMOJI_PUSH = "🚀"
 EMOJI_PR = "🔃"
 EMOJI_PR_REVIEW = {
@@ -7,6 +10,45 @@ EMOJI_PR_REVIEW = {
     "commented": "💬",
     "default": "🔔",
 }
+# Libellé de l'état d'une review, même clés que EMOJI_PR_REVIEW
+REVIEW_STATES = {
+    "approved": "a approuvé",
+    "changes_requested": "demande des modifications sur",
+    "commented": "a commenté",
+    "default": "a fait une review sur",
+}
+# Ligne de review d'une carte de PR
+REVIEW_CARD_STATES = {
+    "approved": "a approuvé",
+    "changes_requested": "demande des modifications",
+    "commented": "a commenté",
+    "default": "a fait une review",
+}
+# État d'une carte de PR : (emoji, libellé)
+PR_CARD_STATUSES = {
+    "open": ("🟢", "Ouverte"),
+    "draft": ("📝", "Brouillon"),
+    "merged": ("🟣", "Fusionnée"),
+    "closed": ("🔴", "Fermée"),
+}
+# Résultat d'un job de CI : (emoji, libellé), "pending" tant qu'il n'est pas terminé
+CI_CONCLUSIONS = {
+    "success": ("✅", "réussi"),
+    "failure": ("❌", "échoué"),
+    "timed_out": ("⏱️", "délai dépassé"),
+    "cancelled": ("⚪", "annulé"),
+    "action_required": ("⚠️", "action requise"),
+    "skipped": ("⏭️", "ignoré"),
+    "neutral": ("➖", "neutre"),
+    "stale": ("➖", "périmé"),
+    "pending": ("⏳", "en cours"),
+}
+# État global d'un commit : (emoji, libellé)
+CI_STATUSES = {
+    "success": ("✅", "réussie"),
+    "failure": ("❌", "en échec"),
+    "pending": ("⏳", "en cours"),
+}
 EMOJI_CREATE = "✨"
 EMOJI_DELETE = "🗑️"
 EMOJI_BRANCH = "🌿"
@@ -15,55 +57,193 @@ EMOJI_AUTHOR = "👤"
 EMOJI_LINK = "📎"
 EMOJI_REVIEWERS = "👀"
 EMOJI_PR_NUMBER = "📌"
-EMOJI_TOOLS = "🔧" 
+EMOJI_TOOLS = "🔧"
+EMOJI_SHED = "📉"
+
+# Templates compilés une fois au chargement (voir render.py)
+PUSH_TEMPLATE = Template(
+    EMOJI_PUSH + " <b>Nouveau Push sur</b> {repo_name:raw}\n"
+    + EMOJI_BRANCH + " <b>Branche/Tag :</b> <code>{ref}</code>\n"
+    + EMOJI_COMMIT + " <b>Commits :</b> {commit_count}\n"
+    + EMOJI_TOOLS + " <b>Dernier commit :</b> {commit_message}\n"
+    + EMOJI_AUTHOR + " <b>Auteur :</b> {sender_username}\n"
+    + "{repo_link:raw}"
+)
+PUSH_DIGEST_TEMPLATE = Template(
+    EMOJI_PUSH + " <b>{push_count} Push sur</b> {repo_name:raw}\n"
+    + EMOJI_BRANCH + " <b>Branche/Tag :</b> <code>{ref}</code>\n"
+    + EMOJI_COMMIT + " <b>Commits :</b> {commit_count}\n"
+    + EMOJI_TOOLS + " <b>Dernier commit :</b> {commit_message}\n"
+    + EMOJI_AUTHOR + " <b>Auteurs :</b> {authors_str}\n"
+    + "{repo_link:raw}"
+)
+PULL_REQUEST_TEMPLATE = Template(
+    EMOJI_PR + " <b>Nouvelle Pull Request sur</b> {repo_name:raw}\n"
+    + EMOJI_PR_NUMBER + " <b>PR #{pr_number} :</b> {pr_title}\n"
+    + EMOJI_BRANCH + " <b>Branche :</b> <code>{head_branch}</code> → <code>{base_branch}</code>\n"
+    + EMOJI_AUTHOR + " <b>Auteur :</b> {sender_username}\n"
+    + EMOJI_REVIEWERS + " <b>Reviewers assignés :</b> {pr_reviewers_str}\n"
+    + EMOJI_LINK + ' <a href="{pr_url}">Voir PR</a>'
+)
+PULL_REQUEST_REVIEW_TEMPLATE = Template(
+    "{emoji} {reviewer} <b>{state_str}</b> la PR de {pr_author} :\n"
+    + EMOJI_PR_NUMBER + " <b>PR #{pr_number} :</b> {pr_title}\n"
+    + "{comment:raw}"
+    + EMOJI_LINK + ' <a href="{pr_url}">Voir PR</a>'
+)
+PULL_REQUEST_CARD_TEMPLATE = Template(
+    EMOJI_PR + " <b>Pull Request sur</b> {repo_name:raw}\n"
+    + EMOJI_PR_NUMBER + " <b>PR #{pr_number} :</b> {pr_title}\n"
+    + EMOJI_BRANCH + " <b>Branche :</b> <code>{head_branch}</code> → <code>{base_branch}</code>\n"
+    + EMOJI_AUTHOR + " <b>Auteur :</b> {pr_author}\n"
+    + "{status_emoji} <b>État :</b> {status}\n"
+    + EMOJI_REVIEWERS + " <b>Reviewers assignés :</b> {pr_reviewers_str}\n"
+    + "{reviews:raw}"
+    + EMOJI_LINK + ' <a href="{pr_url}">Voir PR</a>'
+)
+REVIEW_LINE_TEMPLATE = Template("{emoji} {reviewer} {state_str}\n")
+CI_SUMMARY_TEMPLATE = Template(
+    "{status_emoji} <b>CI {status} sur</b> {repo_name:raw}\n"
+    + EMOJI_BRANCH + " <b>Branche :</b> <code>{branch}</code>\n"
+    + EMOJI_COMMIT + " <b>Commit :</b> <code>{sha}</code>\n"
+    + "{runs:raw}"
+    + "{repo_link:raw}"
+)
+CI_RUN_LINE_TEMPLATE = Template('{emoji} <a href="{url}">{name}</a> : {conclusion}\n')
+REVIEW_COMMENT_TEMPLATE = Template("<b>Commentaire :</b>\n{body}\n")
+CREATE_EVENT_TEMPLATE = Template(
+    EMOJI_CREATE + " <b>{action} :</b> {repo_name:raw}\n"
+    + EMOJI_BRANCH + " <b>Nom :</b> <code>{ref}</code>\n"
+    + EMOJI_AUTHOR + " <b>Auteur :</b> {sender_username}\n"
+    + "{repo_link:raw}"
+)
+DELETE_EVENT_TEMPLATE = Template(
+    EMOJI_DELETE + " <b>{action} :</b> {repo_name:raw}\n"
+    + EMOJI_BRANCH + " <b>Nom :</b> <code>{ref}</code>\n"
+    + EMOJI_AUTHOR + " <b>Auteur :</b> {sender_username}\n"
+    + "{repo_link:raw}"
+)
+SHED_SUMMARY_TEMPLATE = Template(
+    EMOJI_SHED + " <b>{count} notifications non envoyées</b> (file d'envoi chargée) :\n"
+    + "{lines:raw}"
+)
+SHED_LINE_TEMPLATE = Template("• {event_type} : {count}\n")
+REPO_LINK_TEMPLATE = Template(EMOJI_LINK + ' <a href="{repo_url}">Voir dépôt</a>')
+
+
+# Nom et lien du dépôt déjà échappés, identiques pour tous les messages d'un même dépôt
+@lru_cache(maxsize=1024)
+def repo_fragments(repo_name: str, repo_url: str):
+    name = "<code>%s</code>" if MESSAGE_PARSE_MODE == "HTML" else "`%s`"
+    return name % escape(repo_name, CODE), REPO_LINK_TEMPLATE.render(repo_url=repo_url)
 
 
 def format_push_message(repo_name, ref, commit_count, commit_message, sender_username, repo_url):
-    return (
-        f"{EMOJI_PUSH} **Nouveau Push sur** `{repo_name}`\n"
-        f"{EMOJI_BRANCH} **Branche/Tag :** `{ref}`\n"
-        f"{EMOJI_COMMIT} **Commits :** {commit_count}\n"
-        f"{EMOJI_TOOLS} **Dernier commit :** {commit_message[:200]}...\n"
-        f"{EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
-        f"{EMOJI_LINK} [Voir dépôt]({repo_url})"
+    repo_name, repo_link = repo_fragments(repo_name, repo_url)
+    return PUSH_TEMPLATE.render(
+        repo_name=repo_name,
+        repo_link=repo_link,
+        ref=ref,
+        commit_count=commit_count,
+        commit_message=truncate(commit_message, 200),
+        sender_username=sender_username,
+    )
+
+def format_push_digest_message(repo_name, ref, push_count, commit_count, commit_message, authors_str, repo_url):
+    repo_name, repo_link = repo_fragments(repo_name, repo_url)
+    return PUSH_DIGEST_TEMPLATE.render(
+        repo_name=repo_name,
+        repo_link=repo_link,
+        ref=ref,
+        push_count=push_count,
+        commit_count=commit_count,
+        commit_message=truncate(commit_message, 200),
+        authors_str=authors_str,
     )
 
-def format_pull_request_message(repo_name, pr_number, pr_title, head_branch, base_branch, sender_username, pr_reviewers_str, pr_url):
-    return (
-        f"{EMOJI_PR} **Nouvelle Pull Request sur** `{repo_name}`\n"
-        f"{EMOJI_PR_NUMBER} **PR #{pr_number} :** {pr_title[:100]}...\n"
-        f"{EMOJI_BRANCH} **Branche :** `{head_branch}` → `{base_branch}`\n"
-        f"{EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
-        f"{EMOJI_REVIEWERS} **Reviewers assignés :** {pr_reviewers_str}\n"
-        f"{EMOJI_LINK} [Voir PR]({pr_url})"
+def format_pull_request_message(repo_name, pr_number, pr_title, head_branch, base_branch, sender_username, pr_reviewers_str, pr_url, repo_url=""):
+    return PULL_REQUEST_TEMPLATE.render(
+        repo_name=repo_fragments(repo_name, repo_url)[0],
+        pr_number=pr_number,
+        pr_title=truncate(pr_title, 100),
+        head_branch=head_branch,
+        base_branch=base_branch,
+        sender_username=sender_username,
+        pr_reviewers_str=pr_reviewers_str,
+        pr_url=pr_url,
     )
 
 def format_pull_request_review_message(emoji, reviewer, state_str, pr_author, pr_number, pr_title, body, pr_url):
-    msg = (
-        f"{emoji} {reviewer} {state_str} la PR de {pr_author} :\n"
-        f"{EMOJI_PR_NUMBER} **PR #{pr_number} :** {pr_title[:100]}...\n"
+    comment = REVIEW_COMMENT_TEMPLATE.render(body=truncate(body, 200)) if body else ""
+    return PULL_REQUEST_REVIEW_TEMPLATE.render(
+        emoji=emoji,
+        reviewer=reviewer,
+        state_str=state_str,
+        pr_author=pr_author,
+        pr_number=pr_number,
+        pr_title=truncate(pr_title, 100),
+        comment=comment,
+        pr_url=pr_url,
     )
-    if body:
-        msg += f"**Commentaire :**\n{body[:200]}...\n"
-    msg += f"{EMOJI_LINK} [Voir PR]({pr_url})"
-    return msg
 
 def format_create_event_message(action, repo_name, ref, sender_username, repo_url):
-    return (
-        f"{EMOJI_CREATE} **{action} :** `{repo_name}`\n"
-        f"{EMOJI_BRANCH} **Nom :** `{ref}`\n"
-        f"{EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
-        f"{EMOJI_LINK} [Voir dépôt]({repo_url})"
+    repo_name, repo_link = repo_fragments(repo_name, repo_url)
+    return CREATE_EVENT_TEMPLATE.render(
+        repo_name=repo_name,
+        repo_link=repo_link,
+        action=action,
+        ref=ref,
+        sender_username=sender_username,
     )
 
 def format_delete_event_message(action, repo_name, ref, sender_username, repo_url):
-    return (
-        f"{EMOJI_DELETE} **{action} :** `{repo_name}`\n"
-        f"{EMOJI_BRANCH} **Nom :** `{ref}`\n"
-        f"{EMOJI_AUTHOR} **Auteur :** {sender_username}\n"
-        f"{EMOJI_LINK} [Voir dépôt]({repo_url})"
+    repo_name, repo_link = repo_fragments(repo_name, repo_url)
+    return DELETE_EVENT_TEMPLATE.render(
+        repo_name=repo_name,
+        repo_link=repo_link,
+        action=action,
+        ref=ref,
+        sender_username=sender_username,
+    )
+
+# Carte de PR : reviews = [(emoji, reviewer, libellé), ...] dans l'ordre d'arrivée
+def format_pull_request_card(repo_name, repo_url, pr_number, pr_title, head_branch, base_branch, pr_author, status, pr_reviewers_str, reviews, pr_url):
+    status_emoji, status_str = PR_CARD_STATUSES[status]
+    return PULL_REQUEST_CARD_TEMPLATE.render(
+        repo_name=repo_fragments(repo_name, repo_url)[0],
+        pr_number=pr_number,
+        pr_title=truncate(pr_title, 100),
+        head_branch=head_branch,
+        base_branch=base_branch,
+        pr_author=pr_author,
+        status_emoji=status_emoji,
+        status=status_str,
+        pr_reviewers_str=pr_reviewers_str,
+        reviews="".join(REVIEW_LINE_TEMPLATE.render(emoji=emoji, reviewer=reviewer, state_str=state_str)
+                        for emoji, reviewer, state_str in reviews),
+        pr_url=pr_url,
+    )
+
+# Résumé CI d'un commit : runs = [(nom, conclusion, url), ...], conclusion parmi CI_CONCLUSIONS
+def format_ci_summary_message(repo_name, repo_url, branch, sha, status, runs):
+    status_emoji, status_str = CI_STATUSES[status]
+    lines = []
+    for name, conclusion, url in runs:
+        emoji, conclusion_str = CI_CONCLUSIONS.get(conclusion, CI_CONCLUSIONS["neutral"])
+        lines.append(CI_RUN_LINE_TEMPLATE.render(emoji=emoji, url=url, name=name, conclusion=conclusion_str))
+    repo_name, repo_link = repo_fragments(repo_name, repo_url)
+    return CI_SUMMARY_TEMPLATE.render(
+        repo_name=repo_name,
+        repo_link=repo_link,
+        status_emoji=status_emoji,
+        status=status_str,
+        branch=branch,
+        sha=sha[:7],
+        runs="".join(lines),
     )
 
-# Fonction pour remplacer les caractères spéciaux Markdown, proposée par chatGPT
-def escape_markdown(text: str) -> str:
-    return text.replace('*', '').replace('_', '').replace('[', '').replace(']', '')
\ No newline at end of file
+# Résumé des notifications délestées : counts = {type d'évènement: nombre}
+def format_shed_summary_message(counts):
+    lines = [SHED_LINE_TEMPLATE.render(event_type=event_type, count=count)
+             for event_type, count in sorted(counts.items(), key=lambda item: -item[1])]
+    return SHED_SUMMARY_TEMPLATE.render(count=sum(counts.values()), lines="".join(lines))
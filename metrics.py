@@ -0,0 +1,205 @@
+# metrics.py
+# Métriques au format texte Prometheus, sans dépendance externe.
+# Chaque combinaison de labels est créée une fois puis mise en cache : une mesure coûte
+# une recherche dans un dict et une recherche dichotomique dans les buckets.
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Buckets en secondes, de 0.5 ms à 10 s (timeout GitHub)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Un type de métrique définit ses enfants (une valeur par combinaison de labels) et leurs lignes
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.labels()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        ...
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(line + "\n" for line in self._samples())
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, map(_escape, values))} {child.value}"
+                for values, child in self._children.items()]
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    # La valeur est lue au moment du scrape, rien n'est fait sur le chemin critique
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, map(_escape, values))} {child.get()}"
+                for values, child in self._children.items()]
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+    def _samples(self):
+        lines = []
+        for values, child in self._children.items():
+            values = list(map(_escape, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, values, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            bucket_labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {child.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {child.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+
+def render() -> str:
+    return "".join(metric.render() for metric in REGISTRY)
+
+
+# Métriques du bot
+STAGE_LATENCY = Histogram("bot_stage_duration_seconds",
+                          "Durée de chaque étape du traitement d'un webhook GitHub", ["stage"])
+GITHUB_EVENTS = Counter("bot_github_events_total",
+                        "Webhooks GitHub reçus par type d'évènement et résultat", ["event", "outcome"])
+TELEGRAM_MESSAGES = Counter("bot_telegram_messages_total",
+                            "Messages Telegram par résultat", ["outcome"])
+TELEGRAM_ERRORS = Counter("bot_telegram_errors_total",
+                          "Erreurs de l'API Telegram par type", ["error"])
+TELEGRAM_RETRY_AFTER = Counter("bot_telegram_retry_after_total",
+                               "Réponses 429 (RetryAfter) de l'API Telegram")
+TELEGRAM_UPDATES = Counter("bot_telegram_updates_total",
+                           "Updates reçues sur /telegram par résultat", ["outcome"])
+NOTIFICATIONS_SHED = Counter("bot_notifications_shed_total",
+                             "Notifications de faible priorité délestées (file d'envoi chargée)", ["event"])
+QUEUE_DEPTH = Gauge("bot_queue_depth", "Nombre d'éléments en attente", ["queue"])
+TELEGRAM_POOL = Gauge("bot_telegram_pool_connections",
+                      "Pool HTTP vers l'API Telegram : taille et requêtes en cours", ["state"])
@@ -0,0 +1,208 @@
+# outbox.py
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from sender import Notification
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Chemin vide pour désactiver l'outbox
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", "outbox.db")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_BATCH_DELAY = float(os.getenv("OUTBOX_BATCH_DELAY", "0.005"))
+OUTBOX_COMPACT_INTERVAL = float(os.getenv("OUTBOX_COMPACT_INTERVAL", "300"))
+
+PENDING = 0
+DONE = 1
+FAILED = 2
+
+
+# Journal local des notifications : écrit avant d'acquitter GitHub, marqué une fois envoyé,
+# rejoué au démarrage. Les écritures sont regroupées en une transaction par lot (group commit).
+# Les évènements acquittés mais pas encore envoyés (push en attente de digest, jobs de CI) y sont
+# aussi gardés jusqu'à ce que le message qui les contient soit en file.
+class Outbox:
+    def __init__(self, path: str = OUTBOX_FILE, batch_size: int = OUTBOX_BATCH_SIZE,
+                 batch_delay: float = OUTBOX_BATCH_DELAY, compact_interval: float = OUTBOX_COMPACT_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.compact_interval = compact_interval
+        # Un seul thread pour toutes les opérations SQLite : la connexion n'est jamais partagée
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # En WAL, NORMAL ne perd rien si le process s'arrête, seulement en cas de crash de la machine
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                chat_id TEXT NOT NULL,
+                thread_id INTEGER,
+                text TEXT NOT NULL,
+                parse_mode TEXT,
+                edit_message_id INTEGER,
+                status INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        """)
+        # Outbox créée avant les cartes de PR : ajout de la colonne manquante
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")]
+        if "edit_message_id" not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN edit_message_id INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS held (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    async def start(self):
+        await self._run(self._open)
+        self._writes = asyncio.Queue()
+        await self._run(self._compact)
+        self._tasks.append(asyncio.create_task(self._writer(), name="outbox-writer"))
+        self._tasks.append(asyncio.create_task(self._compactor(), name="outbox-compactor"))
+        logger.info("Outbox ouverte : %s", self.path)
+
+    async def stop(self):
+        # Les marquages en attente sont écrits avant la fermeture
+        await self._writes.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        logger.info("Outbox fermée")
+
+    # Enregistre la notification et attend que le lot contenant l'écriture soit commité
+    async def record(self, notification: Notification):
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait(("insert", notification, future))
+        await future
+
+    # Garde le payload d'un évènement regroupé avant d'acquitter GitHub, retourne son id pour release()
+    async def hold(self, kind: str, payload: Any) -> int:
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait(("hold", {"kind": kind, "payload": json.dumps(payload), "id": None}, future))
+        return await future
+
+    # Le message contenant ces évènements est en file (donc dans l'outbox) : ils ne seront pas rejoués
+    def release(self, held_ids: List[int]):
+        if held_ids:
+            self._writes.put_nowait(("release", list(held_ids), None))
+
+    # Évènements gardés par hold() et pas encore relâchés, dans l'ordre de réception
+    async def held(self, kind: str) -> List[Tuple[int, Any]]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT id, payload FROM held WHERE kind = ? ORDER BY id", (kind,)).fetchall())
+        return [(held_id, json.loads(payload)) for held_id, payload in rows]
+
+    # Le marquage n'est pas attendu : au pire la notification est renvoyée au redémarrage
+    def _mark(self, notification: Notification, status: int):
+        if notification.outbox_id is not None:
+            self._writes.put_nowait(("mark", notification, status))
+
+    def mark_done(self, notification: Notification):
+        self._mark(notification, DONE)
+
+    # Abandonnée (échec définitif ou refusée) : elle ne sera pas rejouée
+    def mark_failed(self, notification: Notification):
+        self._mark(notification, FAILED)
+
+    async def pending(self) -> List[Notification]:
+        rows = await self._run(lambda: self._conn.execute(
+            "SELECT id, chat_id, thread_id, text, parse_mode, edit_message_id FROM outbox WHERE status = ? ORDER BY id",
+            (PENDING,)).fetchall())
+        notifications = []
+        for outbox_id, chat_id, thread_id, text, parse_mode, edit_message_id in rows:
+            notification = Notification(chat_id, thread_id, text, parse_mode)
+            notification.outbox_id = outbox_id
+            notification.edit_message_id = edit_message_id
+            notifications.append(notification)
+        return notifications
+
+    async def _writer(self):
+        while True:
+            batch = [await self._writes.get()]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._writes.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._run(self._write_batch, batch)
+                for op, item, future in batch:
+                    if op in ("insert", "hold") and not future.done():
+                        future.set_result(item["id"] if op == "hold" else None)
+            except Exception as e:
+                logger.error("Erreur d'écriture dans l'outbox : %s", e)
+                for op, _, future in batch:
+                    if op in ("insert", "hold") and not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _write_batch(self, batch):
+        now = time.time()
+        with self._conn:
+            for op, item, arg in batch:
+                if op == "insert":
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (chat_id, thread_id, text, parse_mode, edit_message_id, status, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (str(item.chat_id),
+                         None if item.thread_id is None else int(item.thread_id),
+                         item.text, item.parse_mode, item.edit_message_id, PENDING, now))
+                    item.outbox_id = cursor.lastrowid
+                elif op == "hold":
+                    cursor = self._conn.execute("INSERT INTO held (kind, payload, created_at) VALUES (?, ?, ?)",
+                                                (item["kind"], item["payload"], now))
+                    item["id"] = cursor.lastrowid
+                elif op == "release":
+                    self._conn.executemany("DELETE FROM held WHERE id = ?", [(held_id,) for held_id in item])
+                else:
+                    self._conn.execute("UPDATE outbox SET status = ? WHERE id = ?", (arg, item.outbox_id))
+
+    # Supprime les notifications traitées et tronque le WAL pour que le fichier ne grossisse pas
+    def _compact(self):
+        with self._conn:
+            deleted = self._conn.execute("DELETE FROM outbox WHERE status != ?", (PENDING,)).rowcount
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            logger.info("Outbox compactée : %d notifications supprimées", deleted)
+
+    async def _compactor(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self._run(self._compact)
+            except Exception as e:
+                logger.error("Erreur de compaction de l'outbox : %s", e)
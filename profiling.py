@@ -0,0 +1,244 @@
+# profiling.py
+# Outils de diagnostic réservés à l'admin (DEBUG_TOKEN) : profil cProfile d'une livraison GitHub
+# à la demande ou par échantillonnage, profil par échantillonnage de tout le process pendant une
+# durée bornée, et les livraisons les plus lentes avec la durée de chaque étape.
+import io
+import os
+import sys
+import hmac
+import time
+import heapq
+import random
+import asyncio
+import cProfile
+import marshal
+import pstats
+import threading
+from itertools import count
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+from metrics import STAGE_LATENCY
+
+load_dotenv()
+# Vide : endpoints /debug désactivés (404) et aucun profil à la demande
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+DEBUG_TOKEN_HEADER = "X-Debug-Token"
+# Part des livraisons GitHub profilées, 0 pour ne profiler qu'à la demande (header X-Debug-Token)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Profils de livraisons gardés en mémoire
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+SLOW_DELIVERIES_SIZE = int(os.getenv("SLOW_DELIVERIES_SIZE", "20"))
+# Les livraisons plus anciennes (s) sortent du classement des plus lentes
+SLOW_DELIVERIES_WINDOW = float(os.getenv("SLOW_DELIVERIES_WINDOW", "3600"))
+
+# Durées (s) des étapes de la requête en cours, None hors d'une livraison suivie
+stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+# Profils de la livraison en cours : celui de la boucle asyncio et ceux des threads (asyncio.to_thread)
+_current_profiles: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar("current_profiles", default=None)
+
+
+# Comparaison en octets : compare_digest refuse les str non ASCII, qu'un header peut contenir
+def is_debug_token(token: Optional[str]) -> bool:
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+
+# Mesure une étape pour la métrique STAGE_LATENCY et pour la livraison en cours
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(name).observe(elapsed)
+        timings = stage_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+# asyncio.to_thread, profilé dans son thread si la livraison en cours est profilée
+async def run_in_thread(func: Callable[[], Any]) -> Any:
+    profiles = _current_profiles.get()
+    if profiles is None:
+        return await asyncio.to_thread(func)
+    profile = cProfile.Profile()
+    profiles.append(profile)
+    return await asyncio.to_thread(profile.runcall, func)
+
+
+# Les N livraisons les plus lentes de la dernière fenêtre, en tas (la plus rapide en tête)
+class SlowDeliveries:
+    def __init__(self, size: int = SLOW_DELIVERIES_SIZE, window: float = SLOW_DELIVERIES_WINDOW):
+        self.size = size
+        self.window = window
+        self._heap = []
+        self._ids = count()
+
+    def _expire(self, now: float):
+        if any(now - entry["at"] > self.window for _, _, entry in self._heap):
+            self._heap = [item for item in self._heap if now - item[2]["at"] <= self.window]
+            heapq.heapify(self._heap)
+
+    def record(self, entry: Dict[str, Any]):
+        self._expire(entry["at"])
+        item = (entry["duration_ms"], next(self._ids), entry)
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, item)
+        elif item[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        self._expire(time.time())
+        return [entry for _, _, entry in sorted(self._heap, key=lambda item: item[0], reverse=True)]
+
+
+# Profils cProfile des livraisons, les PROFILE_KEEP derniers
+class DeliveryProfiler:
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, keep: int = PROFILE_KEEP,
+                 slow: Optional[SlowDeliveries] = None):
+        self.sample_rate = sample_rate
+        self.profiles = deque(maxlen=keep)
+        self.slow = slow or SlowDeliveries()
+        self._ids = count(1)
+        # cProfile ne gère qu'un profil actif par thread : une livraison profilée à la fois
+        self._active = False
+
+    def _wants_profile(self, headers) -> bool:
+        if self._active:
+            return False
+        if is_debug_token(headers.get(DEBUG_TOKEN_HEADER)):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    # Exécute le traitement d'une livraison en mesurant ses étapes, sous cProfile si demandé.
+    # Les autres tâches de la boucle exécutées pendant les await apparaissent aussi dans le profil.
+    async def track(self, request, handler: Callable[[], Awaitable[Any]]) -> Any:
+        timings: Dict[str, float] = {}
+        timings_token = stage_timings.set(timings)
+        profiles = None
+        if self._wants_profile(request.headers):
+            self._active = True
+            profiles = [cProfile.Profile()]
+            profiles_token = _current_profiles.set(profiles)
+            profiles[0].enable()
+        status = 500
+        start = time.perf_counter()
+        try:
+            response = await handler()
+            status = getattr(response, "status_code", 200)
+            return response
+        except Exception as e:
+            status = getattr(e, "status_code", 500)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            entry = {
+                "delivery_id": request.headers.get("X-GitHub-Delivery"),
+                "event_type": request.headers.get("X-GitHub-Event"),
+                "status": status,
+                "at": time.time(),
+                "duration_ms": round(duration * 1000, 3),
+                "stages_ms": {name: round(value * 1000, 3) for name, value in timings.items()},
+            }
+            stage_timings.reset(timings_token)
+            if profiles is not None:
+                profiles[0].disable()
+                _current_profiles.reset(profiles_token)
+                self._active = False
+                entry["profile_id"] = self._store(entry, profiles)
+            self.slow.record(entry)
+
+    def _store(self, entry: Dict[str, Any], profiles: List[cProfile.Profile]) -> int:
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        profile_id = next(self._ids)
+        self.profiles.append({**entry, "id": profile_id, "stats": stats})
+        return profile_id
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [{key: value for key, value in profile.items() if key != "stats"} for profile in self.profiles]
+
+    def get(self, profile_id: int) -> Optional[Dict[str, Any]]:
+        return next((profile for profile in self.profiles if profile["id"] == profile_id), None)
+
+    # Rapport texte trié par temps cumulé
+    @staticmethod
+    def report(profile: Dict[str, Any], limit: int = 60) -> str:
+        stream = io.StringIO()
+        stats = profile["stats"]
+        stats.stream = stream
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    # Format binaire de pstats, lisible par pstats.Stats(fichier) ou snakeviz
+    @staticmethod
+    def dump(profile: Dict[str, Any]) -> bytes:
+        return marshal.dumps(profile["stats"].stats)
+
+
+# Profil de tout le process par échantillonnage des piles de tous les threads (sys._current_frames),
+# au format "collapsed stacks" (une pile par ligne, pour flamegraph.pl ou speedscope)
+class SamplingProfiler:
+    def __init__(self, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self.samples: Counter = Counter()
+        self.started_at = None
+        self.duration = 0.0
+        self.interval = 0.0
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.005) -> bool:
+        if self.running:
+            return False
+        self.samples = Counter()
+        self.sample_count = 0
+        self.duration = min(seconds, self.max_seconds)
+        self.interval = max(interval, 0.001)
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline and not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def status(self) -> Dict[str, Any]:
+        return {"running": self.running, "started_at": self.started_at, "duration": self.duration,
+                "interval": self.interval, "samples": self.sample_count}
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.samples.most_common())
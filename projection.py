@@ -0,0 +1,131 @@
+# projection.py
+# Décodage JSON qui ne construit que les champs déclarés par une projection.
+# Une projection est un dict clé -> règle :
+#   True    : garder la valeur telle quelle
+#   {...}   : sous-projection sur un objet
+#   [{...}] : sous-projection appliquée à chaque élément d'un tableau
+#   COUNT   : ne garder que le nombre d'éléments du tableau
+# Les valeurs ignorées sont parcourues élément par élément puis jetées,
+# donc un gros tableau n'est jamais entièrement matérialisé.
+import json
+from json.decoder import JSONDecodeError, WHITESPACE, scanstring
+from typing import Any, Dict, Tuple, Union
+
+COUNT = "count"
+
+_scan_once = json.JSONDecoder().scan_once
+
+
+def _skip_ws(s: str, idx: int) -> int:
+    return WHITESPACE.match(s, idx).end()
+
+
+def _scan(s: str, idx: int) -> Tuple[Any, int]:
+    try:
+        return _scan_once(s, idx)
+    except StopIteration as e:
+        raise JSONDecodeError("Valeur attendue", s, e.value) from None
+
+
+def _expect(s: str, idx: int, char: str) -> int:
+    if s[idx:idx + 1] != char:
+        raise JSONDecodeError(f"'{char}' attendu", s, idx)
+    return idx + 1
+
+
+def _walk_array(s: str, idx: int, on_element) -> int:
+    # on_element(s, idx) traite l'élément qui commence à idx et retourne la position qui le suit
+    idx = _skip_ws(s, _expect(s, idx, "["))
+    if s[idx:idx + 1] == "]":
+        return idx + 1
+    while True:
+        idx = _skip_ws(s, on_element(s, idx))
+        if s[idx:idx + 1] == "]":
+            return idx + 1
+        idx = _skip_ws(s, _expect(s, idx, ","))
+
+
+def _skip_element(s: str, idx: int) -> int:
+    # Un élément de tableau est décodé par le scanner C puis jeté tout de suite
+    return _scan(s, idx)[1]
+
+
+def _skip_value(s: str, idx: int) -> int:
+    char = s[idx:idx + 1]
+    if char == "{":
+        return _project_object(s, idx, {}, None)
+    if char == "[":
+        return _walk_array(s, idx, _skip_element)
+    return _scan(s, idx)[1]
+
+
+def _project_value(s: str, idx: int, rule) -> Tuple[Any, int]:
+    if rule is True:
+        return _scan(s, idx)
+    char = s[idx:idx + 1]
+    if rule == COUNT:
+        if char != "[":
+            return _scan(s, idx)
+        count = 0
+        def count_element(s, i):
+            nonlocal count
+            count += 1
+            return _skip_element(s, i)
+        end = _walk_array(s, idx, count_element)
+        return count, end
+    if isinstance(rule, dict):
+        if char != "{":
+            return _scan(s, idx)
+        result = {}
+        return result, _project_object(s, idx, rule, result)
+    if isinstance(rule, list):
+        if char != "[":
+            return _scan(s, idx)
+        items = []
+        def project_element(s, i):
+            value, end = _project_value(s, i, rule[0])
+            items.append(value)
+            return end
+        return items, _walk_array(s, idx, project_element)
+    raise ValueError(f"Règle de projection inconnue : {rule!r}")
+
+
+def _project_object(s: str, idx: int, projection: Dict[str, Any], result) -> int:
+    idx = _skip_ws(s, _expect(s, idx, "{"))
+    if s[idx:idx + 1] == "}":
+        return idx + 1
+    while True:
+        idx = _expect(s, idx, '"')
+        key, idx = scanstring(s, idx)
+        idx = _skip_ws(s, _expect(s, _skip_ws(s, idx), ":"))
+        rule = projection.get(key)
+        if rule is None or result is None:
+            idx = _skip_value(s, idx)
+        else:
+            result[key], idx = _project_value(s, idx, rule)
+        idx = _skip_ws(s, idx)
+        if s[idx:idx + 1] == "}":
+            return idx + 1
+        idx = _skip_ws(s, _expect(s, idx, ","))
+
+
+# Décode un document JSON en ne gardant que les champs de la projection
+def decode_projected(raw: Union[bytes, str], projection: Dict[str, Any]) -> Dict[str, Any]:
+    s = raw.decode("utf-8") if isinstance(raw, (bytes, bytearray)) else raw
+    idx = _skip_ws(s, 0)
+    result = {}
+    idx = _skip_ws(s, _project_object(s, idx, projection, result))
+    if idx != len(s):
+        raise JSONDecodeError("Données en trop", s, idx)
+    return result
+
+
+# Fusionne deux projections (les règles de la seconde l'emportent)
+def merge_projections(base: Dict[str, Any], extra: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, rule in extra.items():
+        if isinstance(rule, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_projections(merged[key], rule)
+        else:
+            merged[key] = rule
+    return merged
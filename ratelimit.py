@@ -0,0 +1,123 @@
+# ratelimit.py
+import os
+import time
+import random
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+from dotenv import load_dotenv
+from telegram.error import RetryAfter
+
+from metrics import TELEGRAM_RETRY_AFTER
+from logs import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Limites Telegram : ~30 messages/s pour le bot, 20 messages/minute par groupe
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+CHAT_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_CHAT_RATE_PER_MINUTE", "20"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+RETRY_JITTER = float(os.getenv("RETRY_JITTER", "0.2"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Réserve un jeton et retourne le temps à attendre avant de pouvoir l'utiliser.
+    # Le solde peut devenir négatif : les appels suivants attendent leur tour dans l'ordre.
+    def reserve(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self, now: float) -> float:
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+
+# Cadence tous les envois sortants et gère les RetryAfter (429) de Telegram
+class SendScheduler:
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate_per_minute: float = CHAT_RATE_PER_MINUTE,
+                 max_retries: int = SEND_MAX_RETRIES, jitter: float = RETRY_JITTER, shared=None):
+        self.global_rate = global_rate
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate_per_minute / 60
+        self.chat_capacity = chat_rate_per_minute
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.waiting: Dict[Hashable, int] = {}
+        self.paused_until: Dict[Hashable, float] = {}
+        self.retry_after_count = 0
+        # Seaux partagés entre workers (shared.SharedBuckets), sinon seaux locaux au process
+        self.shared = shared
+
+    def _bucket(self, key: Hashable) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.chat_rate, self.chat_capacity)
+        return bucket
+
+    async def _acquire(self, key: Hashable):
+        now = time.monotonic()
+        pause = max(0.0, self.paused_until.get(key, 0.0) - now)
+        if self.shared:
+            name = f"{key[0]}:{key[1]}"
+            wait = max(await self.shared.reserve([("global", self.global_rate, self.global_rate),
+                                                  (name, self.chat_rate, self.chat_capacity)], name), pause)
+        else:
+            wait = max(self.global_bucket.reserve(now), self._bucket(key).reserve(now), pause)
+        if wait > 0:
+            logger.info("Envoi vers %s retardé de %.2fs par le rate limit", key, wait, extra=SAMPLED)
+            await asyncio.sleep(wait)
+
+    # Exécute send() pour la destination (chat_id, message_thread_id) en respectant les limites
+    async def send(self, key: Tuple[Any, Any], send: Callable[[], Awaitable[Any]]) -> Any:
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._acquire(key)
+                try:
+                    return await send()
+                except RetryAfter as e:
+                    self.retry_after_count += 1
+                    TELEGRAM_RETRY_AFTER.inc()
+                    if attempt == self.max_retries:
+                        raise
+                    retry_after = e.retry_after
+                    if isinstance(retry_after, timedelta):
+                        retry_after = retry_after.total_seconds()
+                    delay = retry_after * (1 + random.uniform(0, self.jitter))
+                    self.paused_until[key] = time.monotonic() + delay
+                    if self.shared:
+                        await self.shared.pause(f"{key[0]}:{key[1]}", time.time() + delay)
+                    logger.warning("RetryAfter de Telegram pour %s : nouvel essai dans %.2fs (%d/%d)",
+                                   key, delay, attempt + 1, self.max_retries)
+        finally:
+            self.waiting[key] -= 1
+            if not self.waiting[key]:
+                del self.waiting[key]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        destinations = {}
+        for key, bucket in self.buckets.items():
+            wait = max(bucket.wait_time(now), self.paused_until.get(key, 0.0) - now, 0.0)
+            if wait or key in self.waiting:
+                destinations[f"{key[0]}:{key[1]}"] = {
+                    "waiting": self.waiting.get(key, 0),
+                    "wait_seconds": round(wait, 3),
+                }
+        return {
+            "waiting": sum(self.waiting.values()),
+            "global_wait_seconds": round(self.global_bucket.wait_time(now), 3),
+            "retry_after_count": self.retry_after_count,
+            "destinations": destinations,
+        }
@@ -0,0 +1,163 @@
+# render.py
+# Templates de messages compilés une fois pour le parse mode Telegram choisi.
+# Un template s'écrit en HTML restreint (<b>, <i>, <code>, <a href="{champ}">) avec des champs {nom} :
+# le texte fixe est échappé à la compilation, chaque champ est échappé selon l'endroit où il se trouve
+# (texte, bloc de code ou URL de lien). Chaque template devient une fonction à arguments nommés qui
+# ne fait plus qu'une f-string : seuls les échappements des champs restent à l'exécution.
+import os
+import re
+import keyword
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+# "HTML" ou "MarkdownV2"
+MESSAGE_PARSE_MODE = os.getenv("MESSAGE_PARSE_MODE", "HTML")
+
+TEXT, CODE, URL = "text", "code", "url"
+
+
+# Une regex détecte les champs sans caractère spécial, renvoyés tels quels (la plupart) ; sinon un
+# str.replace par caractère présent, 3 fois plus rapide qu'un sub() qui rappelle Python à chaque caractère.
+# (str.translate avec des remplacements de plusieurs caractères est 5 à 15 fois plus lent en CPython)
+# Le caractère d'échappement vient en premier dans mapping pour ne pas rééchapper ceux ajoutés.
+def _escaper(mapping: Dict[str, str]) -> Callable[[Any], str]:
+    search = re.compile("[" + re.escape("".join(mapping)) + "]").search
+    pairs = list(mapping.items())
+
+    def escape(text: Any) -> str:
+        text = str(text)
+        if search(text) is None:
+            return text
+        for char, replacement in pairs:
+            if char in text:
+                text = text.replace(char, replacement)
+        return text
+    return escape
+
+
+# HTML n'a que 3 ou 4 caractères à remplacer : des tests "in" et str.replace coûtent moins qu'une regex.
+# "&" est remplacé en premier pour ne pas rééchapper les entités ajoutées.
+def _html(text: Any) -> str:
+    text = str(text)
+    if "&" in text or "<" in text or ">" in text:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return text
+
+
+def _html_attribute(text: Any) -> str:
+    text = str(text)
+    if "&" in text or "<" in text or ">" in text or '"' in text:
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    return text
+
+
+# Échappement par contexte, voir https://core.telegram.org/bots/api#formatting-options
+ESCAPES = {
+    "HTML": {TEXT: _html, CODE: _html, URL: _html_attribute},
+    "MarkdownV2": {
+        TEXT: _escaper({c: "\\" + c for c in "\\_*[]()~`>#+-=|{}.!"}),
+        CODE: _escaper({c: "\\" + c for c in "\\`"}),
+        URL: _escaper({c: "\\" + c for c in "\\)"}),
+    },
+}
+
+# Balises du template traduites pour chaque parse mode
+_TAGS = {
+    "HTML": {"<b>": "<b>", "</b>": "</b>", "<i>": "<i>", "</i>": "</i>", "<code>": "<code>", "</code>": "</code>",
+             "<a>": '<a href="', "<a>>": '">', "</a>": "</a>"},
+    "MarkdownV2": {"<b>": "*", "</b>": "*", "<i>": "_", "</i>": "_", "<code>": "`", "</code>": "`",
+                   "<a>": "[", "<a>>": "](", "</a>": ")"},
+}
+
+_TOKEN = re.compile(r'<(/?)(b|i|code)>|<a href="\{(\w+)\}">|</a>|\{(\w+)(:raw)?\}')
+
+
+def escape(text: Any, context: str = TEXT, parse_mode: str = MESSAGE_PARSE_MODE) -> str:
+    return ESCAPES[parse_mode][context](text)
+
+
+# Coupe un texte trop long, avant échappement pour ne jamais couper une séquence d'échappement
+def truncate(text: str, length: int) -> str:
+    return text if len(text) <= length else text[:length].rstrip() + "…"
+
+
+class Template:
+    def __init__(self, source: str, parse_mode: str = MESSAGE_PARSE_MODE):
+        self.source = source
+        self.parse_mode = parse_mode
+        # (texte fixe déjà échappé, None, None) ou (None, champ, échappement ou None pour :raw)
+        self.pieces: List[Tuple[Optional[str], Optional[str], Optional[Callable[[Any], str]]]] = []
+        self._compile()
+        # render(**champs) -> message, voir _build
+        self.render = self._build()
+
+    def _literal(self, text: str):
+        if not text:
+            return
+        if self.pieces and self.pieces[-1][0] is not None:
+            self.pieces[-1] = (self.pieces[-1][0] + text, None, None)
+        else:
+            self.pieces.append((text, None, None))
+
+    def _slot(self, name: str, table):
+        # Le nom devient un paramètre de render
+        if keyword.iskeyword(name) or name.startswith("_"):
+            raise ValueError(f"Nom de champ invalide dans un template : {name}")
+        self.pieces.append((None, name, table))
+
+    def _compile(self):
+        tags = _TAGS[self.parse_mode]
+        tables = ESCAPES[self.parse_mode]
+        context = TEXT
+        link = None
+        position = 0
+        for match in _TOKEN.finditer(self.source):
+            self._literal(tables[context](self.source[position:match.start()]))
+            position = match.end()
+            closing, tag, href, field, raw = match.groups()
+            if tag:
+                self._literal(tags[f"<{closing}{tag}>"])
+                if tag == "code":
+                    context = TEXT if closing else CODE
+            elif href:
+                # En MarkdownV2 l'URL vient après le libellé : on la garde pour la fermeture du lien
+                if self.parse_mode == "HTML":
+                    self._literal(tags["<a>"])
+                    self._slot(href, tables[URL])
+                    self._literal(tags["<a>>"])
+                else:
+                    self._literal(tags["<a>"])
+                link = href
+            elif field:
+                self._slot(field, None if raw else tables[context])
+            else:
+                if link is not None and self.parse_mode != "HTML":
+                    self._literal(tags["<a>>"])
+                    self._slot(link, tables[URL])
+                self._literal(tags["</a>"])
+                link = None
+        self._literal(tables[context](self.source[position:]))
+
+    # Génère render(*, champ1, champ2...) : une f-string dont les textes fixes et les échappements sont des
+    # globales de la fonction. Les noms de champs (\w+) sont les seuls éléments du template recopiés dans le code.
+    def _build(self) -> Callable[..., str]:
+        namespace: Dict[str, Any] = {}
+        names: List[str] = []
+        code = []
+        for i, (text, name, table) in enumerate(self.pieces):
+            if text is not None:
+                namespace[f"_t{i}"] = text
+                code.append(f"{{_t{i}}}")
+                continue
+            if name not in names:
+                names.append(name)
+            if table is None:
+                code.append(f"{{{name}}}")
+            else:
+                namespace[f"_e{i}"] = table
+                code.append(f"{{_e{i}({name})}}")
+        parameters = "*, " + ", ".join(names) if names else ""
+        source = f"def render({parameters}):\n    return f'{''.join(code)}'\n"
+        exec(compile(source, f"<template {self.source[:40]!r}>", "exec"), namespace)
+        return namespace["render"]
@@ -0,0 +1,75 @@
+# routing.py
+import os
+import re
+import json
+import fnmatch
+import logging
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+from dotenv import load_dotenv
+
+from filter import event_branch
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+ROUTES_FILE = os.getenv("ROUTES_FILE", "routes.json")
+
+Destination = Tuple[Any, Any]
+
+
+class Route:
+    def __init__(self, config: Dict[str, Any]):
+        self.destination: Destination = (config["chat_id"], config.get("thread_id"))
+        self.events = config.get("events")
+        branches = config.get("branches")
+        self.branches: Optional[Pattern] = re.compile(
+            "|".join(f"(?:{fnmatch.translate(b)})" for b in branches)) if branches else None
+
+    def matches_branch(self, data: Dict[str, Any]) -> bool:
+        if self.branches is None:
+            return True
+        return bool(self.branches.match(event_branch(data)))
+
+
+# Table dépôt -> évènement -> routes, construite une fois au démarrage.
+# Clés de dépôt : "org/repo", puis "org/*", puis "*" ; sans route, la destination par défaut (.env).
+class Router:
+    def __init__(self, default_destination: Destination, routes_file: str = ROUTES_FILE):
+        self.default = [default_destination]
+        self.table: Dict[str, Dict[Optional[str], List[Route]]] = {}
+        if os.path.exists(routes_file):
+            with open(routes_file, "r") as f:
+                self.load(json.load(f))
+            logger.info("Routage chargé : %d entrées depuis %s", len(self.table), routes_file)
+
+    def load(self, config: Dict[str, List[Dict[str, Any]]]):
+        table = {}
+        for repo, routes in config.items():
+            compiled = [Route(route) for route in routes]
+            events = {event for route in compiled for event in (route.events or [])}
+            # Les routes sans "events" s'appliquent à tous les types d'évènement
+            by_event = {None: [route for route in compiled if route.events is None]}
+            for event in events:
+                by_event[event] = [route for route in compiled if route.events is None or event in route.events]
+            table[repo.lower()] = by_event
+        self.table = table
+
+    def _routes(self, event_type: str, repo: str) -> Optional[List[Route]]:
+        by_event = (self.table.get(repo)
+                    or self.table.get(f"{repo.split('/', 1)[0]}/*")
+                    or self.table.get("*"))
+        if by_event is None:
+            return None
+        return by_event.get(event_type, by_event[None])
+
+    def destinations(self, event_type: str, data: Dict[str, Any]) -> List[Destination]:
+        repo = data.get("repository", {}).get("full_name", "").lower()
+        routes = self._routes(event_type, repo)
+        if routes is None:
+            return self.default
+
+        destinations = []
+        for route in routes:
+            if route.matches_branch(data) and route.destination not in destinations:
+                destinations.append(route.destination)
+        return destinations
@@ -0,0 +1,178 @@
+# sender.py
+import os
+import asyncio
+import logging
+from itertools import count
+from typing import Optional
+from dotenv import load_dotenv
+from telegram.error import BadRequest
+from telegram.ext import Application
+
+from ratelimit import SendScheduler
+from render import MESSAGE_PARSE_MODE
+from filter import PRIORITY_NORMAL
+from metrics import STAGE_LATENCY, TELEGRAM_MESSAGES, TELEGRAM_ERRORS
+from logs import SAMPLED, Dump
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+SENDER_WORKERS = int(os.getenv("SENDER_WORKERS", "4"))
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", "1000"))
+QUEUE_PUT_TIMEOUT = float(os.getenv("QUEUE_PUT_TIMEOUT", "2"))
+QUEUE_DRAIN_TIMEOUT = float(os.getenv("QUEUE_DRAIN_TIMEOUT", "10"))
+
+
+class Notification:
+    def __init__(self, chat_id, thread_id, text: str, parse_mode: str = MESSAGE_PARSE_MODE,
+                 priority: int = PRIORITY_NORMAL):
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.text = text
+        self.parse_mode = parse_mode
+        # Classe de priorité (filter.PRIORITY_LEVELS), les plus prioritaires sont envoyées en premier
+        self.priority = priority
+        self.outbox_id = None
+        # Message existant à modifier (cartes de PR) au lieu d'en envoyer un nouveau
+        self.edit_message_id = None
+        # Appelé avec le message_id envoyé ou modifié, None en cas d'échec
+        self.on_done = None
+
+
+# File d'attente des notifications sortantes, vidée par un pool de workers par ordre de priorité
+# puis d'arrivée
+class NotificationQueue:
+    def __init__(self, tg_bot: Application, scheduler: Optional[SendScheduler] = None, outbox=None,
+                 workers: int = SENDER_WORKERS, maxsize: int = QUEUE_MAXSIZE, put_timeout: float = QUEUE_PUT_TIMEOUT):
+        self.tg_bot = tg_bot
+        self.scheduler = scheduler or SendScheduler()
+        self.outbox = outbox
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=maxsize)
+        self._order = count()
+        self._tasks = []
+        self.ready: Optional[asyncio.Event] = None
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    def _item(self, notification: Notification):
+        return (notification.priority, next(self._order), notification)
+
+    # Les workers attendent ready (bot Telegram initialisé) avant de commencer les envois
+    async def start(self, ready: Optional[asyncio.Event] = None):
+        self.ready = ready
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i), name=f"sender-{i}"))
+        logger.info("%d workers d'envoi démarrés", self.workers)
+
+    async def stop(self, drain_timeout: float = QUEUE_DRAIN_TIMEOUT):
+        # Laisse une chance aux messages en attente d'être envoyés avant l'arrêt
+        if self.ready is not None and not self.ready.is_set():
+            drain_timeout = 0
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("%d notifications non envoyées à l'arrêt", self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        logger.info("Workers d'envoi arrêtés")
+
+    # Retourne False si la file est toujours pleine après put_timeout (backpressure).
+    # Avec une outbox, la notification est enregistrée sur disque avant d'être acceptée.
+    async def enqueue(self, notification: Notification, timeout: Optional[float] = None) -> bool:
+        timeout = self.put_timeout if timeout is None else timeout
+        if self.outbox is not None and notification.outbox_id is None:
+            await self.outbox.record(notification)
+        try:
+            await asyncio.wait_for(self.queue.put(self._item(notification)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error("File d'envoi pleine (%d), notification refusée", self.qsize())
+            if self.outbox is not None:
+                self.outbox.mark_failed(notification)
+            return False
+        return True
+
+    # Remet en file les notifications non envoyées avant le dernier arrêt. La lecture est faite tout de suite,
+    # avant les nouvelles notifications ; la remise en file se fait en tâche de fond au rythme des workers.
+    async def replay(self):
+        if self.outbox is None:
+            return
+        pending = await self.outbox.pending()
+        if pending:
+            logger.info("Rejeu de %d notifications de l'outbox", len(pending))
+            self._tasks.append(asyncio.create_task(self._requeue(pending), name="sender-replay"))
+
+    async def _requeue(self, pending):
+        for notification in pending:
+            await self.queue.put(self._item(notification))
+
+    async def _worker(self, n: int):
+        if self.ready is not None:
+            await self.ready.wait()
+        while True:
+            _, _, notification = await self.queue.get()
+            message_id = None
+            try:
+                message_id = await self._send(notification)
+                TELEGRAM_MESSAGES.labels("sent").inc()
+                if self.outbox is not None:
+                    self.outbox.mark_done(notification)
+            except Exception as e:
+                TELEGRAM_MESSAGES.labels("failed").inc()
+                TELEGRAM_ERRORS.labels(type(e).__name__).inc()
+                logger.error("Worker %d : échec de l'envoi à %s : %s", n, notification.chat_id, e)
+                if self.outbox is not None:
+                    self.outbox.mark_failed(notification)
+            finally:
+                self.queue.task_done()
+                if notification.on_done is not None:
+                    try:
+                        notification.on_done(message_id)
+                    except Exception as e:
+                        logger.error("Worker %d : erreur après l'envoi à %s : %s", n, notification.chat_id, e)
+
+    # Retourne le message_id du message envoyé ou modifié
+    async def _send(self, notification: Notification) -> int:
+        # Le texte complet n'est écrit qu'en DEBUG, tronqué
+        logger.info("Envoi du message à CHAT_ID %s (%d caractères)", notification.chat_id, len(notification.text), extra=SAMPLED)
+        logger.debug("Message : %s", Dump(notification.text))
+        message_id = await self.scheduler.send(
+            (notification.chat_id, notification.thread_id),
+            lambda: self._timed_send_message(notification)
+        )
+        logger.info("Notification envoyée", extra=SAMPLED)
+        return message_id
+
+    # Durée d'un appel à l'API Telegram, sans l'attente due au rate limit
+    async def _timed_send_message(self, notification: Notification) -> int:
+        with STAGE_LATENCY.labels("telegram").time():
+            if notification.edit_message_id is not None:
+                try:
+                    message = await self.tg_bot.bot.edit_message_text(
+                        chat_id=notification.chat_id,
+                        message_id=notification.edit_message_id,
+                        text=notification.text,
+                        parse_mode=notification.parse_mode
+                    )
+                    return notification.edit_message_id if message is True else message.message_id
+                except BadRequest as e:
+                    if "not modified" in e.message:
+                        return notification.edit_message_id
+                    # Message supprimé entre-temps : la carte repart dans un nouveau message
+                    if "not found" not in e.message:
+                        raise
+                    logger.warning("Message %s introuvable, nouvel envoi", notification.edit_message_id)
+            message = await self.tg_bot.bot.send_message(
+                chat_id=notification.chat_id,
+                text=notification.text,
+                parse_mode=notification.parse_mode,
+                message_thread_id=notification.thread_id
+            )
+            return message.message_id
+
+    def stats(self):
+        return {"queue_size": self.qsize(), "scheduler": self.scheduler.stats()}
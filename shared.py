@@ -0,0 +1,192 @@
+# shared.py
+# État partagé entre les workers uvicorn (WEB_WORKERS > 1) : budgets d'envoi Telegram et
+# livraisons GitHub déjà traitées dans une base SQLite locale, slots de worker pris par verrou de fichier.
+import os
+import time
+import fcntl
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Any, Dict, Sequence, Tuple
+from dotenv import load_dotenv
+
+from ratelimit import TokenBucket
+from dedupe import DEDUPE_TTL
+
+load_dotenv()
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+SHARED_STATE_FILE = os.getenv("SHARED_STATE_FILE", "shared.db")
+LOCK_DIR = os.getenv("LOCK_DIR", ".")
+# Purge des livraisons expirées toutes les N insertions
+DEDUPE_PURGE_EVERY = 1000
+# Le nombre de livraisons exposé par /stats et /metrics est recompté au plus toutes les N secondes
+DEDUPE_COUNT_INTERVAL = 5.0
+
+# Verrou du slot gardé ouvert pendant toute la vie du process
+_slot_lock = None
+
+
+# Prend le premier slot libre : le worker 0 est le seul à enregistrer le webhook Telegram.
+# Le verrou est relâché par le système à la mort du process, son remplaçant reprend le même slot.
+def claim_worker_slot(lock_dir: str = LOCK_DIR) -> int:
+    global _slot_lock
+    if _slot_lock is not None:
+        return _slot_lock[0]
+    for slot in count():
+        f = open(os.path.join(lock_dir, f"worker-{slot}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            continue
+        f.write(str(os.getpid()))
+        f.flush()
+        _slot_lock = (slot, f)
+        return slot
+
+
+# Fichier propre à un slot : outbox.db, outbox-1.db, outbox-2.db...
+def slot_file(path: str, slot: int) -> str:
+    if not slot:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{slot}{ext}"
+
+
+class SharedDatabase:
+    def __init__(self, path: str = SHARED_STATE_FILE):
+        self.path = path
+        self._local = threading.local()
+        # Les transactions peuvent attendre le verrou d'écriture d'un autre worker (timeout 5 s) :
+        # elles passent par un thread dédié pour ne jamais bloquer la boucle asyncio
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-db")
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    # Une connexion par thread, transactions courtes en WAL
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    paused_until REAL NOT NULL DEFAULT 0
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS deliveries (
+                    id TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self._local.conn = conn
+        return conn
+
+
+# Seaux de jetons communs à tous les workers, mêmes règles que ratelimit.TokenBucket.
+# L'horloge est time.time() : time.monotonic() n'est pas comparable d'un process à l'autre.
+class SharedBuckets:
+    def __init__(self, db: SharedDatabase):
+        self.db = db
+
+    # Réserve un jeton dans chaque seau (nom, débit, capacité) et retourne l'attente la plus longue,
+    # pause RetryAfter de pause_key comprise
+    async def reserve(self, buckets: Sequence[Tuple[str, float, float]], pause_key: str) -> float:
+        return await self.db.run(self._reserve, buckets, pause_key)
+
+    def _reserve(self, buckets: Sequence[Tuple[str, float, float]], pause_key: str) -> float:
+        conn = self.db.conn()
+        now = time.time()
+        wait = 0.0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name, rate, capacity in buckets:
+                bucket = TokenBucket(rate, capacity)
+                row = conn.execute("SELECT tokens, updated, paused_until FROM buckets WHERE name = ?",
+                                   (name,)).fetchone()
+                paused_until = 0.0
+                if row:
+                    bucket.tokens, bucket.updated, paused_until = row
+                wait = max(wait, bucket.reserve(now))
+                if name == pause_key:
+                    wait = max(wait, paused_until - now)
+                conn.execute("INSERT INTO buckets (name, tokens, updated) VALUES (?, ?, ?) "
+                             "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                             (name, bucket.tokens, bucket.updated))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    async def pause(self, name: str, until: float):
+        await self.db.run(self._pause, name, until)
+
+    def _pause(self, name: str, until: float):
+        self.db.conn().execute("UPDATE buckets SET paused_until = MAX(paused_until, ?) WHERE name = ?",
+                               (until, name))
+
+
+# Même interface que dedupe.DeliveryCache, visible par tous les workers
+class SharedDeliveryCache:
+    def __init__(self, db: SharedDatabase, ttl: float = DEDUPE_TTL):
+        self.db = db
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Dernier nombre de livraisons compté par le thread de la base : size() ne touche jamais SQLite
+        self._size = 0
+        self._counted_at = 0.0
+
+    async def check_and_add(self, delivery_id: str) -> bool:
+        return await self.db.run(self._check_and_add, delivery_id)
+
+    def _check_and_add(self, delivery_id: str) -> bool:
+        conn = self.db.conn()
+        now = time.time()
+        # Une livraison expirée est remplacée comme si elle n'avait jamais été vue
+        inserted = conn.execute(
+            "INSERT INTO deliveries (id, expires_at) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET expires_at = excluded.expires_at WHERE deliveries.expires_at <= ?",
+            (delivery_id, now + self.ttl, now)).rowcount
+        if not inserted:
+            self.hits += 1
+            self._count(conn, now)
+            return True
+
+        self.misses += 1
+        if self.misses % DEDUPE_PURGE_EVERY == 0:
+            conn.execute("DELETE FROM deliveries WHERE expires_at <= ?", (now,))
+        self._count(conn, now)
+        return False
+
+    async def discard(self, delivery_id: str):
+        await self.db.run(self._discard, delivery_id)
+
+    def _discard(self, delivery_id: str):
+        conn = self.db.conn()
+        conn.execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
+        self._count(conn, time.time())
+
+    def _count(self, conn: sqlite3.Connection, now: float):
+        if now - self._counted_at >= DEDUPE_COUNT_INTERVAL:
+            self._size = conn.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+            self._counted_at = now
+
+    # Appelé par la gauge /metrics et /stats depuis la boucle asyncio
+    def size(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": self.size(), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,81 @@
+# shedding.py
+# Délestage : au-delà de SHED_QUEUE_DEPTH notifications en file, les évènements de faible priorité
+# ne sont plus formatés ni envoyés. Ils sont comptés par destination et remplacés par un résumé
+# périodique (SHED_POLICY=summary) ou simplement comptés dans les métriques (SHED_POLICY=drop).
+import os
+import asyncio
+import logging
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+from filter import PRIORITY_LOW
+from messages import format_shed_summary_message
+from metrics import NOTIFICATIONS_SHED
+from sender import Notification, NotificationQueue
+from logs import SAMPLED
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+# Profondeur de la file d'envoi à partir de laquelle les évènements "low" sont délestés, 0 pour ne jamais délester
+SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", "200"))
+# "summary" (résumé périodique par destination) ou "drop"
+SHED_POLICY = os.getenv("SHED_POLICY", "summary")
+SHED_SUMMARY_INTERVAL = float(os.getenv("SHED_SUMMARY_INTERVAL", "60"))
+
+
+class LoadShedder:
+    def __init__(self, notifications: NotificationQueue, queue_depth: int = SHED_QUEUE_DEPTH,
+                 policy: str = SHED_POLICY, summary_interval: float = SHED_SUMMARY_INTERVAL):
+        self.notifications = notifications
+        self.queue_depth = queue_depth
+        self.policy = policy
+        self.summary_interval = summary_interval
+        # Évènements délestés par destination depuis le dernier résumé
+        self.pending: Dict[Tuple[Any, Any], Counter] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def should_shed(self, priority: int) -> bool:
+        return (priority >= PRIORITY_LOW and self.queue_depth > 0
+                and self.notifications.qsize() >= self.queue_depth)
+
+    def shed(self, event_type: str, destinations: List[Tuple[Any, Any]]):
+        NOTIFICATIONS_SHED.labels(event_type).inc()
+        logger.info("Évènement délesté, %d notifications en file", self.notifications.qsize(), extra=SAMPLED)
+        if self.policy != "summary":
+            return
+        for destination in destinations:
+            self.pending.setdefault(destination, Counter())[event_type] += 1
+
+    def size(self) -> int:
+        return sum(sum(counts.values()) for counts in self.pending.values())
+
+    # Un message par destination avec le nombre d'évènements délestés par type
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        for (chat_id, thread_id), counts in pending.items():
+            notification = Notification(chat_id, thread_id, format_shed_summary_message(counts), priority=PRIORITY_LOW)
+            if not await self.notifications.enqueue(notification):
+                # Gardé pour le prochain résumé
+                self.pending.setdefault((chat_id, thread_id), Counter()).update(counts)
+                logger.error("Résumé du délestage pour %s:%s refusé, file pleine", chat_id, thread_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            if self.pending:
+                await self.flush()
+
+    async def start(self):
+        if self.policy == "summary":
+            self._task = asyncio.create_task(self._run(), name="shed-summary")
+
+    # Met en file le dernier résumé avant l'arrêt des workers
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.pending:
+            await self.flush()
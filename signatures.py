@@ -0,0 +1,146 @@
+# signatures.py
+# Secrets des webhooks GitHub : une table chargée au démarrage, avec des HMAC déjà initialisés
+# par secret et copiés pour chaque requête. Le secret est choisi d'après les headers du hook,
+# et deux secrets peuvent être acceptés le temps d'une rotation.
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+GITHUB_SECRET = os.getenv("GITHUB_SECRET")
+# Ancien secret encore accepté pendant une rotation, jusqu'à GITHUB_SECRET_PREVIOUS_UNTIL (ISO 8601)
+GITHUB_SECRET_PREVIOUS = os.getenv("GITHUB_SECRET_PREVIOUS")
+GITHUB_SECRET_PREVIOUS_UNTIL = os.getenv("GITHUB_SECRET_PREVIOUS_UNTIL")
+# Secrets par hook ou par dépôt/organisation (voir README)
+GITHUB_SECRETS_FILE = os.getenv("GITHUB_SECRETS_FILE", "github_secrets.json")
+
+HOOK_ID_HEADER = "X-GitHub-Hook-ID"
+TARGET_ID_HEADER = "X-GitHub-Hook-Installation-Target-ID"
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class SigningKey:
+    def __init__(self, secret: str, until: Optional[float] = None):
+        self.secret = secret
+        self.until = until
+        self.mac = hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+    def expired(self, now: float) -> bool:
+        return self.until is not None and now > self.until
+
+
+# Secrets acceptés pour un hook : le body est haché au fil de la lecture avec le secret préféré
+# (le dernier qui a validé une signature), les autres ne sont essayés qu'en cas d'échec
+class SecretSet:
+    def __init__(self, keys: List[SigningKey]):
+        self.keys = keys
+        self.preferred = 0
+
+    def mac(self, index: int):
+        return self.keys[index].mac.copy()
+
+    # computed_hash : HMAC du body avec la clé index, le secret préféré au début de la lecture
+    def verify(self, signature: str, raw_body: bytes, computed_hash: str, index: int) -> bool:
+        now = time.time()
+        if is_matching_signature(signature, computed_hash) and not self.keys[index].expired(now):
+            return True
+        for i, key in enumerate(self.keys):
+            if i == index or key.expired(now):
+                continue
+            mac = key.mac.copy()
+            mac.update(raw_body)
+            if is_matching_signature(signature, mac.hexdigest()):
+                # GitHub signe désormais avec ce secret : il devient le premier essayé
+                if self.preferred != i:
+                    logger.info("Signature validée par un autre secret (%d/%d), utilisé en priorité", i + 1, len(self.keys))
+                    self.preferred = i
+                return True
+        return False
+
+
+def is_matching_signature(signature: str, computed_hash: str) -> bool:
+    if not signature or not signature.startswith("sha256="):
+        return False
+    signature_hash = signature.split("=")[1]
+    return hmac.compare_digest(computed_hash, signature_hash)
+
+
+def _secret_set(entries: List[Any]) -> SecretSet:
+    keys = []
+    for entry in entries:
+        if isinstance(entry, str):
+            keys.append(SigningKey(entry))
+        else:
+            keys.append(SigningKey(entry["secret"], _timestamp(entry.get("until"))))
+    return SecretSet(keys)
+
+
+# Table id de hook / id de dépôt ou d'organisation -> secrets, plus les secrets par défaut
+class SecretTable:
+    def __init__(self, default: Optional[SecretSet], hooks: Dict[str, SecretSet] = None,
+                 targets: Dict[str, SecretSet] = None):
+        self.default = default
+        self.hooks = hooks or {}
+        self.targets = targets or {}
+
+    @classmethod
+    def load(cls, path: str = GITHUB_SECRETS_FILE) -> "SecretTable":
+        default = []
+        if GITHUB_SECRET:
+            default.append(GITHUB_SECRET)
+        if GITHUB_SECRET_PREVIOUS:
+            default.append({"secret": GITHUB_SECRET_PREVIOUS, "until": GITHUB_SECRET_PREVIOUS_UNTIL})
+        config: Dict[str, Any] = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                config = json.load(f)
+            default = config.get("default", default)
+        return cls(
+            _secret_set(default) if default else None,
+            {str(hook_id): _secret_set(entries) for hook_id, entries in config.get("hooks", {}).items()},
+            {str(target_id): _secret_set(entries) for target_id, entries in config.get("targets", {}).items()},
+        )
+
+    # Un seul jeu de secrets par requête : hook, puis dépôt/organisation, puis défaut
+    def select(self, headers: Mapping[str, str]) -> Optional[SecretSet]:
+        if self.hooks:
+            secrets = self.hooks.get(headers.get(HOOK_ID_HEADER, ""))
+            if secrets is not None:
+                return secrets
+        if self.targets:
+            secrets = self.targets.get(headers.get(TARGET_ID_HEADER, ""))
+            if secrets is not None:
+                return secrets
+        return self.default
+
+    # Tous les secrets, pour les masquer dans les logs
+    def secrets(self) -> List[str]:
+        sets = [self.default, *self.hooks.values(), *self.targets.values()]
+        return [key.secret for secret_set in sets if secret_set for key in secret_set.keys]
+
+    def __bool__(self) -> bool:
+        return bool(self.default or self.hooks or self.targets)
+
+
+_table: Optional[SecretTable] = None
+
+
+# Table chargée au premier appel puis partagée par toutes les requêtes du process
+def secret_table() -> SecretTable:
+    global _table
+    if _table is None:
+        _table = SecretTable.load()
+    return _table
@@ -0,0 +1,107 @@
+# telegram_http.py
+# Client HTTP de l'API Bot Telegram : pool de connexions configurable, préchauffé au démarrage
+# et gardé ouvert pendant les périodes calmes pour éviter une nouvelle poignée de main TLS.
+import os
+import time
+import asyncio
+import logging
+import importlib.util
+import httpx
+from dotenv import load_dotenv
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from metrics import TELEGRAM_POOL
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "5"))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "5"))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "1"))
+# "1.1" ou "2" (nécessite httpx[http2])
+TELEGRAM_HTTP_VERSION = os.getenv("TELEGRAM_HTTP_VERSION", "1.1")
+# Durée (s) pendant laquelle une connexion inutilisée reste ouverte (5 s par défaut dans httpx)
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv("TELEGRAM_KEEPALIVE_EXPIRY", "120"))
+# Sans envoi depuis ce délai (s), les connexions sont réutilisées par un getMe ; 0 pour désactiver
+TELEGRAM_KEEPALIVE_INTERVAL = float(os.getenv("TELEGRAM_KEEPALIVE_INTERVAL", "60"))
+# Connexions ouvertes au démarrage, par défaut autant que de workers d'envoi
+TELEGRAM_PREWARM_CONNECTIONS = int(os.getenv("TELEGRAM_PREWARM_CONNECTIONS", os.getenv("SENDER_WORKERS", "4")))
+
+
+def _http_version() -> str:
+    if TELEGRAM_HTTP_VERSION in ("2", "2.0") and importlib.util.find_spec("h2") is None:
+        logger.warning("TELEGRAM_HTTP_VERSION=2 demande le paquet h2 (pip install httpx[http2]), HTTP/1.1 utilisé")
+        return "1.1"
+    return TELEGRAM_HTTP_VERSION
+
+
+# HTTPXRequest qui compte les requêtes en cours pour la métrique d'utilisation du pool
+class PooledRequest(HTTPXRequest):
+    def __init__(self, pool_size: int = TELEGRAM_POOL_SIZE, keepalive_expiry: float = TELEGRAM_KEEPALIVE_EXPIRY):
+        super().__init__(
+            connection_pool_size=pool_size,
+            connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+            read_timeout=TELEGRAM_READ_TIMEOUT,
+            write_timeout=TELEGRAM_WRITE_TIMEOUT,
+            pool_timeout=TELEGRAM_POOL_TIMEOUT,
+            http_version=_http_version(),
+            httpx_kwargs={"limits": httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                                 keepalive_expiry=keepalive_expiry)},
+        )
+        self.pool_size = pool_size
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        TELEGRAM_POOL.labels("size").set(pool_size)
+        TELEGRAM_POOL.labels("in_use").set_function(lambda: self.in_use)
+
+    async def do_request(self, *args, **kwargs):
+        self.in_use += 1
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            self.in_use -= 1
+            self.last_used = time.monotonic()
+
+
+# Ouvre les connexions avant le premier envoi puis les garde actives pendant les périodes calmes
+class ConnectionWarmer:
+    def __init__(self, bot: Bot, request: PooledRequest, connections: int = TELEGRAM_PREWARM_CONNECTIONS,
+                 interval: float = TELEGRAM_KEEPALIVE_INTERVAL):
+        self.bot = bot
+        self.request = request
+        self.connections = min(connections, request.pool_size)
+        self.interval = interval
+        self._task = None
+
+    # getMe en parallèle : chaque appel concurrent ouvre (ou réutilise) sa propre connexion
+    async def warm(self) -> int:
+        if self.connections <= 0:
+            return 0
+        results = await asyncio.gather(*(self.bot.get_me() for _ in range(self.connections)),
+                                       return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.warning("Préchauffage des connexions Telegram : %d échecs (%s)", len(errors), errors[0])
+        return self.connections - len(errors)
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if time.monotonic() - self.request.last_used >= self.interval:
+                await self.warm()
+
+    async def start(self):
+        start = time.perf_counter()
+        ready = await self.warm()
+        logger.info("%d connexions Telegram prêtes en %.0f ms", ready, (time.perf_counter() - start) * 1000)
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._keepalive(), name="telegram-keepalive")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
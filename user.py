@@ -2,50 +2,207 @@
 import json
 import os
 import re
-from typing import Dict
+import logging
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from dotenv import load_dotenv
+
+from profiling import stage
+from shared import WEB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+USERS_FILE = os.getenv("USERS_FILE", "users.json")
+# Stockage du mapping GitHub -> Telegram : "json" ou "sqlite" (par défaut avec plusieurs workers)
+USERS_BACKEND = os.getenv("USERS_BACKEND", "sqlite" if WEB_WORKERS > 1 else "json")
+USERS_DB = os.getenv("USERS_DB", "users.db")
+
+
+# Fichier JSON gardé en mémoire, rechargé seulement si le fichier change
+class JsonUserStore:
+    def __init__(self, path: str = USERS_FILE):
+        self.path = path
+        self._cache: Optional[Dict[str, str]] = None
+        self._cache_stamp: Optional[Tuple[int, int]] = None
+        # Réentrant : set() et delete() gardent le verrou de la lecture jusqu'à l'écriture
+        self._lock = threading.RLock()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def all(self) -> Dict[str, str]:
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp is None:
+                self._write_file({})
+                stamp = self._file_stamp()
+
+            if self._cache is None or stamp != self._cache_stamp:
+                with open(self.path, "r") as f:
+                    try:
+                        self._cache = json.load(f)
+                    except json.JSONDecodeError:
+                        logger.error("Erreur de lecture du fichier %s", self.path)
+                        self._cache = {}
+                self._cache_stamp = stamp
+            return self._cache
+
+    # Écriture atomique : fichier temporaire puis rename, les lecteurs ne voient jamais un fichier à moitié écrit
+    def _write_file(self, mapping: Dict[str, str]):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".users.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(mapping, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def save(self, mapping: Dict[str, str]):
+        with self._lock:
+            self._write_file(mapping)
+            self._cache = dict(mapping)
+            self._cache_stamp = self._file_stamp()
+
+    def get_many(self, github_usernames: Iterable[str]) -> Dict[str, str]:
+        mapping = self.all()
+        return {name: mapping[name] for name in github_usernames if name in mapping}
+
+    def set(self, github_username: str, telegram_username: str):
+        with self._lock:
+            mapping = dict(self.all())
+            mapping[github_username] = telegram_username
+            self.save(mapping)
+
+    def delete(self, github_username: str) -> bool:
+        with self._lock:
+            mapping = dict(self.all())
+            if github_username not in mapping:
+                return False
+            del mapping[github_username]
+            self.save(mapping)
+            return True
+
+
+# Base SQLite indexée : lectures concurrentes entre process (WAL), écritures ligne par ligne
+class SqliteUserStore:
+    def __init__(self, path: str = USERS_DB, json_path: str = USERS_FILE):
+        self.path = path
+        self._local = threading.local()
+        self._migrate(json_path)
+
+    # Une connexion par thread, les lookups pouvant être faits hors de la boucle asyncio
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    github TEXT PRIMARY KEY,
+                    telegram TEXT NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    # Import unique de l'ancien users.json, le fichier n'est pas modifié
+    def _migrate(self, json_path: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+                return
+            if os.path.exists(json_path):
+                with open(json_path, "r") as f:
+                    try:
+                        mapping = json.load(f)
+                    except json.JSONDecodeError:
+                        mapping = {}
+                conn.executemany("INSERT OR IGNORE INTO users (github, telegram) VALUES (?, ?)",
+                                 ((github.lower(), telegram) for github, telegram in mapping.items()))
+                logger.info("%d utilisateurs importés depuis %s", len(mapping), json_path)
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', '1')")
+
+    def all(self) -> Dict[str, str]:
+        return dict(self._conn().execute("SELECT github, telegram FROM users").fetchall())
+
+    def get_many(self, github_usernames: Iterable[str]) -> Dict[str, str]:
+        names = list(set(github_usernames))
+        if not names:
+            return {}
+        placeholders = ",".join("?" * len(names))
+        rows = self._conn().execute(
+            f"SELECT github, telegram FROM users WHERE github IN ({placeholders})", names).fetchall()
+        return dict(rows)
+
+    def set(self, github_username: str, telegram_username: str):
+        with self._conn() as conn:
+            conn.execute("INSERT INTO users (github, telegram) VALUES (?, ?) "
+                         "ON CONFLICT(github) DO UPDATE SET telegram = excluded.telegram",
+                         (github_username, telegram_username))
+
+    def delete(self, github_username: str) -> bool:
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM users WHERE github = ?", (github_username,)).rowcount > 0
+
+
+def create_store():
+    if USERS_BACKEND == "sqlite":
+        return SqliteUserStore()
+    if USERS_BACKEND != "json":
+        raise ValueError(f"USERS_BACKEND inconnu : {USERS_BACKEND}")
+    return JsonUserStore()
 
-USERS_FILE = "users.json"
 
 class UserManager:
+    # Stockage partagé par tout le process, ouvert au démarrage du bot (main.create_app) et non à l'import :
+    # la migration users.json -> SQLite ne tourne pas dans les process qui ne font qu'importer ce module
+    store = None
 
     @staticmethod
-    def load_users() -> Dict[str, str]:
-        if not os.path.exists(USERS_FILE):
-            with open(USERS_FILE, "w") as f:
-                json.dump({}, f)
-        
-        with open(USERS_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                print("Erreur de lecture du fichier users")
-                return {}
-    
+    def open_store():
+        if UserManager.store is None:
+            UserManager.store = create_store()
+        return UserManager.store
+
     @staticmethod
-    def save_users(mapping: Dict[str, str]):
-        with open(USERS_FILE, "w") as f :
-            json.dump(mapping, f, indent=2)
-    
+    def load_users() -> Dict[str, str]:
+        return UserManager.open_store().all()
+
     @staticmethod
     def add_user(github_username:str, telegram_username:str):
         if not re.match(r"^[A-Za-z0-9_]{1,32}$", telegram_username):
             raise ValueError("Pseudo Telegram invalide (lettres, chiffres, underscores, max 32 caractères)")
-        
-        mapping = UserManager.load_users()
-        mapping[github_username.lower()] = telegram_username
-        UserManager.save_users(mapping)
+
+        UserManager.open_store().set(github_username.lower(), telegram_username)
 
     @staticmethod
     def remove_user(github_username:str):
-        mapping = UserManager.load_users()
-        if github_username.lower() in mapping:
-            del mapping[github_username.lower()]
-            UserManager.save_users(mapping)
-        else :
+        if not UserManager.open_store().delete(github_username.lower()):
             raise Warning(f"Aucune correspondance trouvée pour {github_username}")
-        
+
     @staticmethod
     def get_telegram_username(github_username:str)->str:
-        mapping = UserManager.load_users()
-        return mapping.get(github_username.lower(), github_username)
-        
\ No newline at end of file
+        return UserManager.get_telegram_usernames([github_username])[github_username]
+
+    # Résout plusieurs pseudos GitHub avec une seule lecture du stockage
+    @staticmethod
+    def get_telegram_usernames(github_usernames: Iterable[str]) -> Dict[str, str]:
+        github_usernames = list(github_usernames)
+        with stage("users"):
+            mapping = UserManager.open_store().get_many({name.lower() for name in github_usernames})
+        return {name: mapping.get(name.lower(), name) for name in github_usernames}
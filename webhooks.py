@@ -1,103 +1,266 @@
 # webhooks.py
 import os
 import hmac
-import hashlib
+import json
 import logging
 from http import HTTPStatus
+from typing import Tuple
 from fastapi import Request, Response, HTTPException
+from fastapi.responses import JSONResponse
 from telegram import Update
 from telegram.ext import Application 
 
 from event import EVENT_CLASSES
-from filter import MessageFilter
+from filter import MessageFilter, PRIORITY_NORMAL
+from sender import Notification, NotificationQueue
+from coalesce import PushCoalescer
+from dedupe import DeliveryCache
+from routing import Router
+from cards import PRCards
+from ci import CIAggregator
+from shedding import LoadShedder
+from signatures import secret_table
+from metrics import GITHUB_EVENTS, TELEGRAM_UPDATES
+from profiling import stage, run_in_thread
+from logs import SAMPLED, Dump, log_context
 
 logger = logging.getLogger(__name__)
 
-GITHUB_SECRET = os.getenv("GITHUB_SECRET")
 CHAT_ID = os.getenv("CHAT_ID")
 THREAD_ID = os.getenv("THREAD_ID")
+THREAD_ID = int(THREAD_ID) if THREAD_ID is not None else None
+# GitHub limite les payloads à 25 Mo
+MAX_BODY_SIZE = int(os.getenv("MAX_BODY_SIZE", str(25 * 1024 * 1024)))
 
-# Vérifie la signature envoyée par github
-def is_valid_github_signature(signature: str, raw_body: bytes) -> bool:
-    if not signature or not signature.startswith("sha256="):
-        return False
-    signature_hash = signature.split("=")[1]
-    mac = hmac.new(GITHUB_SECRET.encode('utf-8'), raw_body, hashlib.sha256)
-    computed_hash = mac.hexdigest()
-    return hmac.compare_digest(computed_hash, signature_hash)
+# Updates Telegram reçues mais pas encore traitées par le bot, au-delà /telegram répond 503
+TELEGRAM_UPDATE_QUEUE_MAX = int(os.getenv("TELEGRAM_UPDATE_QUEUE_MAX", "100"))
+TELEGRAM_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Les seules updates utiles : les commandes du chat et du topic configurés (voir commands.py)
+COMMAND_UPDATE_TYPES = ("message", "edited_message")
+CHAT_ID_BYTES = CHAT_ID.encode("utf-8") if CHAT_ID else b""
 
+message_filter = MessageFilter()
 
+# Lit le body par morceaux en calculant le HMAC au fil de l'eau, en refusant les body trop gros
+async def read_signed_body(request: Request, mac) -> Tuple[bytes, str]:
+    content_length = request.headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_BODY_SIZE:
+        raise HTTPException(status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE, detail="Body trop volumineux")
+
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_BODY_SIZE:
+            raise HTTPException(status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE, detail="Body trop volumineux")
+        mac.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), mac.hexdigest()
+
+
+# Met un message formaté en file d'attente pour chaque destination.
+# Chaque destination est une entrée distincte de la file : les envois sont faits en parallèle
+# par les workers et l'échec de l'un n'affecte pas les autres.
+async def dispatch_message(message: str, notifications: NotificationQueue, destinations=None,
+                           priority: int = PRIORITY_NORMAL) -> bool:
+    destinations = destinations if destinations is not None else [(CHAT_ID, THREAD_ID)]
+    queued = 0
+    for chat_id, thread_id in destinations:
+        if await notifications.enqueue(Notification(chat_id, thread_id, message, priority=priority)):
+            queued += 1
+        else:
+            logger.error("Notification pour %s:%s refusée, file pleine", chat_id, thread_id)
+    return queued > 0 or not destinations
+
+
+# Tri d'une update Telegram avant de construire les objets python-telegram-bot : retourne le JSON
+# décodé si c'est une commande du chat/topic configuré, None sinon (les handlers l'ignoreraient)
+def relevant_telegram_update(raw_body: bytes):
+    # L'id du chat doit apparaître dans le body : le spam des autres chats n'est même pas décodé
+    if CHAT_ID_BYTES not in raw_body:
+        return None
+    data = json.loads(raw_body)
+    message = next((data[key] for key in COMMAND_UPDATE_TYPES if key in data), None)
+    if not isinstance(message, dict):
+        return None
+    if str(message.get("chat", {}).get("id")) != str(CHAT_ID):
+        return None
+    if THREAD_ID is not None and message.get("message_thread_id") != THREAD_ID:
+        return None
+    if not (message.get("text") or "").startswith("/"):
+        return None
+    return data
+
+
+# Endpoint pour les webhooks telegram : l'update est mise dans la file de l'Application et
+# traitée en arrière-plan (concurrent_updates), Telegram reçoit 200 tout de suite
+async def process_telegram_update(request: Request, tg_bot: Application, secret_token: str = None):
+    logger.info("Requête Telegram reçue", extra=SAMPLED)
+    # Seul Telegram connaît le secret passé à setWebhook. Comparaison en octets : compare_digest refuse les
+    # str non ASCII qu'un header peut contenir
+    if secret_token and not hmac.compare_digest(request.headers.get(TELEGRAM_SECRET_HEADER, "").encode(),
+                                                secret_token.encode()):
+        TELEGRAM_UPDATES.labels("invalid_secret").inc()
+        logger.error("Secret Telegram invalide")
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Secret invalide")
 
-# Endpoint pour les webhooks telegram
-async def process_telegram_update(request: Request, tg_bot: Application):
-    logger.info("Requête Telegram reçue")
     try:
-        message = await request.json()
-        update = Update.de_json(data=message, bot=tg_bot.bot)
-        if update:
-            await tg_bot.process_update(update)
-        return Response(status_code=HTTPStatus.OK)
+        data = relevant_telegram_update(await request.body())
+        if data is None:
+            TELEGRAM_UPDATES.labels("ignored").inc()
+            return Response(status_code=HTTPStatus.OK)
+        update = Update.de_json(data=data, bot=tg_bot.bot)
     except Exception as e:
-        logger.error(f"Erreur dans process_update : {str(e)}")
+        TELEGRAM_UPDATES.labels("error").inc()
+        logger.error("Update Telegram invalide : %s", e)
         raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=str(e))
+
+    # File pleine : Telegram renverra l'update plus tard
+    if tg_bot.update_queue.qsize() >= TELEGRAM_UPDATE_QUEUE_MAX:
+        TELEGRAM_UPDATES.labels("queue_full").inc()
+        logger.error("File des updates Telegram pleine (%d)", tg_bot.update_queue.qsize())
+        raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail="File des updates pleine")
+    tg_bot.update_queue.put_nowait(update)
+    TELEGRAM_UPDATES.labels("queued").inc()
+    return Response(status_code=HTTPStatus.OK)
     
 
 # Endpoint pour les webhooks github
-async def receive_github_webhook(request: Request, tg_bot: Application):
-    logger.info("Requête webhook GitHub reçue")
+async def receive_github_webhook(request: Request, notifications: NotificationQueue, coalescer: PushCoalescer = None,
+                                 deliveries: DeliveryCache = None, router: Router = None, cards: PRCards = None,
+                                 ci: CIAggregator = None, shedder: LoadShedder = None):
+    event_type = request.headers.get("X-GitHub-Event")
+    # Les logs de la requête portent l'identifiant de livraison et le type d'évènement
+    log_context.set({"delivery_id": request.headers.get("X-GitHub-Delivery"), "event_type": event_type})
+    logger.info("Requête webhook GitHub reçue : %s", event_type, extra=SAMPLED)
+
     signature = request.headers.get("X-Hub-Signature-256")
-    logger.debug(f"Signature : {signature}")
     if not signature:
         logger.error("Signature manquante")
         raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Signature manquante")
 
-    raw_body = await request.body()
-    logger.debug(f"Body : {raw_body[:100]}...")
+    if not event_type:
+        logger.error("Événement manquant")
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Événement manquant")
 
-    if not is_valid_github_signature(signature, raw_body):
-        logger.error("Signature invalide")
+    # Label borné aux types connus : le header n'est pas encore authentifié
+    event_label = event_type if event_type in EVENT_CLASSES or event_type == "ping" else "other"
+
+    # Rejet sur les headers seuls, avant de lire le body
+    if event_type != "ping" and not message_filter.is_event_type_enabled(event_type):
+        GITHUB_EVENTS.labels(event_label, "filtered").inc()
+        logger.info("Événement ignoré par les filtres")
+        return {"message": "Événement ignoré par les filtres"}
+
+    # Un seul jeu de secrets essayé, choisi d'après l'id du hook ou du dépôt/de l'organisation
+    secrets = secret_table().select(request.headers)
+    if secrets is None:
+        GITHUB_EVENTS.labels(event_label, "invalid_signature").inc()
+        logger.error("Aucun secret pour ce hook")
         raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Signature invalide")
 
-    event = request.headers.get("X-GitHub-Event")
-    logger.info(f"Événement : {event}")
-    if not event:
-        logger.error("Événement manquant")
-        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Événement manquant")
+    with stage("signature"):
+        # Haché avec le secret préféré, les autres ne sont essayés que si la signature ne correspond pas
+        index = secrets.preferred
+        raw_body, computed_hash = await read_signed_body(request, secrets.mac(index))
+        valid_signature = secrets.verify(signature, raw_body, computed_hash, index)
+    logger.debug("Body : %s", Dump(raw_body))
 
-    try:
-        data = await request.json()
-        logger.debug(f"Données : {data}")
+    if not valid_signature:
+        GITHUB_EVENTS.labels(event_label, "invalid_signature").inc()
+        logger.error("Signature invalide")
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Signature invalide")
 
-        if event == "ping":
-            logger.info("Ping reçu")
-            return {"message": "Webhook pingé avec succès"}
+    # GitHub renvoie les livraisons en cas de timeout ou de "Redeliver" manuel
+    delivery_id = request.headers.get("X-GitHub-Delivery")
+    if deliveries is not None and delivery_id and await deliveries.check_and_add(delivery_id):
+        GITHUB_EVENTS.labels(event_label, "duplicate").inc()
+        logger.info("Livraison %s déjà traitée", delivery_id)
+        return {"message": "Livraison déjà traitée"}
 
-        message_filter = MessageFilter()
-        if not message_filter.is_event_enabled(event, data):
-            logger.info("Événement ignoré par les filtres")
-            return {"message": "Événement ignoré par les filtres"}
+    if event_type == "ping":
+        GITHUB_EVENTS.labels(event_label, "ping").inc()
+        logger.info("Ping reçu")
+        return {"message": "Webhook pingé avec succès"}
 
-        event_class = EVENT_CLASSES.get(event)
+    try:
+        event_class = EVENT_CLASSES.get(event_type)
         if not event_class:
+            GITHUB_EVENTS.labels(event_label, "unsupported").inc()
             logger.error("Événement non supporté")
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Événement non supporté")
 
+        # Seuls les champs utiles à l'évènement sont décodés
+        with stage("parse"):
+            data = event_class.decode(raw_body)
+        logger.debug("Données : %s", Dump(data))
+
+        with stage("filter"):
+            enabled = message_filter.is_event_enabled(event_type, data)
+        if not enabled:
+            GITHUB_EVENTS.labels(event_label, "filtered").inc()
+            logger.info("Événement ignoré par les filtres")
+            return {"message": "Événement ignoré par les filtres"}
+
         event = event_class(data)
-        message = event.format_message()
+        if coalescer and coalescer.accepts(event):
+            await coalescer.add(data)
+            GITHUB_EVENTS.labels(event_label, "coalesced").inc()
+            logger.info("Push mis en attente de regroupement", extra=SAMPLED)
+            return JSONResponse(status_code=HTTPStatus.ACCEPTED, content={"message": "Push mis en attente de regroupement"})
+
+        destinations = router.destinations(event_type, data) if router else None
+        if destinations == []:
+            GITHUB_EVENTS.labels(event_label, "no_destination").inc()
+            logger.info("Aucune destination pour cet évènement")
+            return {"message": "Aucune destination pour cet évènement"}
+
+        # Les jobs de CI d'un commit donnent un seul résumé, envoyé quand ils sont tous terminés
+        if ci and ci.accepts(event):
+            await ci.add(event, destinations if destinations is not None else [(CHAT_ID, THREAD_ID)])
+            GITHUB_EVENTS.labels(event_label, "aggregated").inc()
+            logger.info("Statut CI mis à jour", extra=SAMPLED)
+            return JSONResponse(status_code=HTTPStatus.ACCEPTED, content={"message": "Statut CI mis à jour"})
+
+        # Mode carte : le message de la PR est créé ou modifié après le délai de regroupement
+        if cards and event_type in ("pull_request", "pull_request_review"):
+            if await cards.update(event_type, data, destinations if destinations is not None else [(CHAT_ID, THREAD_ID)]):
+                GITHUB_EVENTS.labels(event_label, "card").inc()
+                logger.info("Carte de PR mise à jour", extra=SAMPLED)
+                return JSONResponse(status_code=HTTPStatus.ACCEPTED, content={"message": "Carte de PR mise à jour"})
+
+        # File d'envoi chargée : les évènements de faible priorité ne sont ni formatés ni envoyés
+        priority = message_filter.priority(event_type, data)
+        if shedder and shedder.should_shed(priority):
+            shedder.shed(event_type, destinations if destinations is not None else [(CHAT_ID, THREAD_ID)])
+            GITHUB_EVENTS.labels(event_label, "shed").inc()
+            return JSONResponse(status_code=HTTPStatus.ACCEPTED, content={"message": "Évènement délesté, file d'envoi chargée"})
+
+        # Le message est formaté une seule fois pour toutes les destinations,
+        # hors de la boucle asyncio car il lit le mapping des utilisateurs
+        with stage("format"):
+            message = await run_in_thread(event.format_message)
         if not message:
             logger.error("Message vide")
             raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Message vide")
 
-        logger.info(f"Envoi du message à CHAT_ID {CHAT_ID}: {message}")
-        await tg_bot.bot.send_message(
-            chat_id=CHAT_ID,
-            text=message,
-            parse_mode="Markdown",
-            message_thread_id=THREAD_ID
-        )
-        logger.info("Notification envoyée")
-        return {"message": "Notification envoyée"}
+        # L'envoi Telegram est fait par les workers, on acquitte GitHub tout de suite
+        with stage("enqueue"):
+            queued = await dispatch_message(message, notifications, destinations, priority)
+        if not queued:
+            GITHUB_EVENTS.labels(event_label, "queue_full").inc()
+            raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE, detail="File d'envoi pleine")
+        GITHUB_EVENTS.labels(event_label, "queued").inc()
+        logger.info("Notification mise en file d'attente", extra=SAMPLED)
+        return JSONResponse(status_code=HTTPStatus.ACCEPTED, content={"message": "Notification mise en file d'attente"})
 
+    except HTTPException as e:
+        if deliveries is not None and delivery_id and e.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+            await deliveries.discard(delivery_id)
+        raise
     except Exception as e:
-        logger.error(f"Erreur : {str(e)}")
+        GITHUB_EVENTS.labels(event_label, "error").inc()
+        if deliveries is not None and delivery_id:
+            await deliveries.discard(delivery_id)
+        logger.error("Erreur : %s", e)
         raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=f"Erreur : {str(e)}")